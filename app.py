@@ -1,14 +1,26 @@
 import streamlit as st
 import pandas as pd
+import uuid
 
 from core.config import load_config
-from core.io import read_any
+from core import perf, runs
+from core.io import (read_any, read_csv_header, read_parquet_window, parquet_columns, parquet_date_bounds,
+                     excel_sheets, excel_header, is_csv, MultiUpload)
+from core.cache import cached_read, dataset_cache, dataset_key, insight_cache, upload_key
+from core.normalize import compact_frame
+from core.spill import spill_cache
+from core.prepared import PreparedDataset
+from core.cube import build_cube
+from core.filter_index import build_filter_index
+from core.fingerprint import rows_fingerprint
 from core.semantics import suggest_mappings, ColumnMapping
 from core.mapping import mapping_widget
-from core.filters import render_global_filters
+from core.filters import render_global_filters, date_range_key, parquet_scan, DATE_RANGE_KEY
 from core.profiling import quick_profile
 
-from insights.registry import run_all
+from insights.registry import LazyResults
+from insights.service import available as service_available, publish, worker_service
+from insights import engine
 from ui.tabs import (
     render_overview_tab,
     render_products_tab,
@@ -153,6 +165,27 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 cfg = load_config()
+perf.start_run(cfg)  # collects timings / peak memory of this rerun for the Performance panel
+engine.configure(cfg)
+if engine.missing():
+    st.sidebar.warning(f"compute.engine is {engine.missing()!r} but it is not installed "
+                       f"(pip install {engine.missing()}); running the insights on pandas.")
+executor = cfg["compute"].get("executor", "thread")
+if executor == "process":
+    # a process pool would pickle the whole dataset into its workers on every filter change;
+    # the service's workers memory-map one published copy instead
+    print("[app] compute.executor 'process' runs on the worker service in the app")
+    executor = "service"
+if executor == "service" and not service_available():
+    # no fork() here (macOS / Windows): spawned workers would re-run this script
+    print("[app] The worker service needs fork(), which this platform lacks; using threads")
+    executor = "thread"
+elif executor == "service" and not engine.fork_safe():
+    # Polars' thread pool does not survive fork(); its workers would hang
+    print(f"[app] compute.engine {engine.current()!r} cannot run on the worker service; using threads")
+    executor = "thread"
+if executor == "service":
+    worker_service(cfg)  # first run on this server spawns the warm worker pool, before any upload
 
 with st.sidebar:
     st.markdown("""
@@ -167,10 +200,19 @@ with st.sidebar:
         <h3 style="margin: 0 0 1rem 0; color: #1e293b; font-size: 1.2rem;">📁 Data Upload</h3>
     """, unsafe_allow_html=True)
     
-    upl = st.file_uploader(
+    uploads = st.file_uploader(
         "Upload CSV / Excel / Parquet", 
-        type=["csv","xlsx","xls","parquet"],
-        help="Upload your business data file"
+        type=["csv","gz","bz2","zst","xlsx","xls","parquet","zip"],
+        accept_multiple_files=True,
+        help="Upload your business data file (CSV may be .gz / .bz2 / .zst compressed) — "
+             "or several monthly exports / a ZIP of them to combine"
+    )
+
+    stream_csv = st.toggle(
+        "⚡ Streaming mode (large CSV / Excel / Parquet)",
+        value=False,
+        help="Read only the mapped columns plus any extras you pick: CSV in chunks, "
+             "Excel per column, Parquet memory-mapped and limited to the sidebar date range"
     )
     
     st.markdown("""
@@ -213,11 +255,92 @@ with st.sidebar:
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Load data
+# Several files (or a ZIP) are parsed in parallel and unioned into one dataset
+upl = None
+if uploads:
+    if len(uploads) == 1 and not uploads[0].name.lower().endswith(".zip"):
+        upl = uploads[0]
+    else:
+        try:
+            upl = MultiUpload(uploads)
+        except Exception as e:
+            st.error(f"Failed to read upload: {e}")
+
 df = None
+schema_cols = None  # full column list when only a projection of the file is loaded
+date_bounds = None
 if upl is not None:
     try:
-        df = read_any(upl)
+        backend = cfg["io"].get("dtype_backend")
+        upload_id = upload_key(upl, memo=st.session_state.setdefault("upload_digests", {}))
+        # the date picker is keyed per upload; forget the ranges picked for earlier files
+        date_key = date_range_key(upload_id)
+        for k in [k for k in st.session_state if str(k).startswith(DATE_RANGE_KEY) and k != date_key]:
+            del st.session_state[k]
+        name = upl.name.lower()
+
+        sheets = None
+        if name.endswith((".xlsx", ".xls")):
+            # Sheet picker: every selected worksheet is parsed in parallel and unioned
+            all_sheets = dataset_cache().get_or_build(f"{upload_id}|sheets", lambda: excel_sheets(upl))
+            if len(all_sheets) > 1:
+                sheets = st.sidebar.multiselect("Sheets", all_sheets, default=all_sheets[:1]) or all_sheets[:1]
+
+        def reader(f):
+            return read_any(f, dtype_backend=backend, max_workers=cfg["io"].get("ingest_workers"), sheets=sheets)
+        variant = f"backend:{backend}" + (f"|sheets:{sheets}" if sheets else "")
+        src = None
+        if stream_csv and is_csv(name):
+            schema_cols = read_csv_header(upl)
+        elif stream_csv and name.endswith((".xlsx", ".xls")):
+            schema_cols = excel_header(upl, sheets)
+        elif stream_csv and name.endswith(".parquet"):
+            # Keep the upload on disk so the scan can memory-map it
+            src = spill_cache(cfg).materialize(upload_id.split(":", 1)[0] + "-src", upl.getvalue())
+            schema_cols = parquet_columns(src) if src is not None else None
+
+        if schema_cols is not None:
+            # Project the read onto the mapped columns (saved mapping, else suggestions from the header)
+            mapped = st.session_state.get("mapping") or suggest_mappings(pd.DataFrame(columns=schema_cols))
+            keep = [c for c in mapped.values() if c in schema_cols]
+            extras = st.sidebar.multiselect("Extra columns to load", [c for c in schema_cols if c not in keep])
+            usecols = keep + extras
+            date_cols = [mapped["date"]] if mapped.get("date") else []
+            numeric_cols = [mapped["amount"]] if mapped.get("amount") else []
+
+            if src is not None:
+                # Push the sidebar date window (from the previous run) down into the Parquet scan
+                date_bounds = parquet_date_bounds(src, mapped.get("date"))
+                window = st.session_state.get(date_key)
+                window = tuple(window) if date_bounds and window and len(window) == 2 else None
+
+                def reader(f):
+                    return read_parquet_window(src, usecols, mapped.get("date"), window, dtype_backend=backend)
+                variant += f"|scan:{','.join(usecols)}|{window}"
+            else:
+                def reader(f):
+                    return read_any(f, usecols=usecols, date_cols=date_cols, numeric_cols=numeric_cols,
+                                    chunksize=cfg["io"].get("csv_chunksize"), dtype_backend=backend,
+                                    max_workers=cfg["io"].get("ingest_workers"), sheets=sheets)
+                variant += "|stream:" + ",".join(usecols)
+
+        data_key = dataset_key(upload_id, variant)
+        df, origin = cached_read(upl, reader, max_mb=cfg["limits"].get("dataset_cache_mb"),
+                                 variant=variant, key=data_key, spill=spill_cache(cfg))
         st.success(f"Loaded data: {df.shape[0]} rows, {df.shape[1]} columns.")
+        if isinstance(upl, MultiUpload) and len(upl.names) > 1:
+            st.caption(f"🗂️ Combined {len(upl.names)} files: " + ", ".join(upl.names))
+        if origin == "memory":
+            st.caption("⚡ Loaded from cache — file was not re-parsed.")
+        elif origin == "disk":
+            st.caption("💾 Loaded the saved Parquet copy of this file — no re-parse needed.")
+        elif df.attrs.get("ingest"):
+            ing = df.attrs["ingest"]
+            st.caption(
+                f"🗜️ {ing['codec']}: {ing['compressed_mb']:.1f} MB compressed → {ing['parsed_mb']:.1f} MB CSV · "
+                f"decompression {ing['compressed_mb_s']:.0f} MB/s (compressed) · "
+                f"parsing {ing['parsed_mb_s']:.0f} MB/s (decompressed) · {ing['seconds']:.1f}s total"
+            )
         
         # Beautiful Industry Selection Section
         st.markdown("---")
@@ -290,9 +413,8 @@ if upl is not None:
 # Profile + Mapping
 mapping = None
 if df is not None:
-    with st.expander("🔍 Data Preview & Quick Profile", expanded=False):
-        st.dataframe(df.head(50), use_container_width=True)
-        st.json(quick_profile(df))
+    # Filled in after mapping so the profile can report the dtype compaction
+    profile_box = st.container()
 
     st.subheader("🧭 Column Mapping")
     
@@ -301,8 +423,9 @@ if df is not None:
         industry_icons = {"Retail": "🏪", "SaaS": "☁️", "Marketplace": "🛒"}
         st.info(f"{industry_icons.get(preset, '🏢')} **{preset} Industry Mode**: Column mapping suggestions are optimized for {preset.lower()} businesses.")
     
-    sugg = suggest_mappings(df, industry=preset.lower())
-    selected = mapping_widget(df, suggestions=sugg)
+    columns_df = df if schema_cols is None else pd.DataFrame(columns=schema_cols)
+    sugg = suggest_mappings(columns_df, industry=preset.lower())
+    selected = mapping_widget(columns_df, suggestions=sugg)
 
     if selected:
         if isinstance(selected, dict):
@@ -320,52 +443,90 @@ if df is not None:
                 st.session_state["mapping"] = selected
             st.caption("✔ Mapping saved.")
 
+            # A projected read does not include newly mapped columns yet: reload
+            if schema_cols is not None and any(
+                c in schema_cols and c not in df.columns for c in mapping.to_dict().values()
+            ):
+                st.rerun()
+
+            # Compact mapped columns once; the cached frame is replaced so reruns reuse it
+            compacted, _ = compact_frame(df, mapping)
+            if compacted is not df:
+                df = compacted
+                dataset_cache().put(data_key, df)
+
+    with profile_box:
+        with st.expander("🔍 Data Preview & Quick Profile", expanded=False):
+            st.dataframe(df.head(50), use_container_width=True)
+            st.json(quick_profile(df))
+
 # Insights - Cache results to avoid regeneration
 if df is not None and mapping is not None:
-    filtered_df, active_filters = render_global_filters(df, mapping)
+    # Parse / factorize the mapped columns once per (data, mapping); every insight shares it
+    prepared_key = f"{data_key}|prepared|{sorted(mapping.to_dict().items())}"
+    def _prepare():
+        ds = PreparedDataset.build(df, mapping)
+        if src is not None:
+            ds.scan = parquet_scan(src, window)  # lets the polars engine re-scan the file itself
+        if cfg["compute"].get("cube", True):
+            # additive aggregates per (day, product, channel): filters and sums then touch cells, not rows
+            ds.cube = build_cube(ds)
+        if cfg["compute"].get("filter_index", True):
+            # sorted dates + per-value row positions: sidebar filters become bitmap ANDs and one take
+            ds.index = build_filter_index(ds)
+        return ds
 
-    # Cache insights to avoid regeneration
-    @st.cache_data(show_spinner=False)
-    def _run_insights_cached(sig: str):
-        return run_all(filtered_df, mapping)
-    
-    # Create stable signature for caching
-    insights_signature = f"{df.shape}-{hash(str(mapping))}-{hash(str(active_filters))}"
-    
-    # Only show spinner if insights aren't cached yet
-    if "insights" not in st.session_state or st.session_state.get("insights_signature") != insights_signature:
-        with st.spinner("Running insights..."):
-            results = _run_insights_cached(insights_signature)
-        st.session_state["insights"] = results
-        st.session_state["insights_signature"] = insights_signature
-        st.success("✅ Insights generated successfully!")
-    else:
-        results = st.session_state["insights"]
-        # Show subtle indicator that insights are loaded from cache
-        st.caption("💡 Using cached insights - instant performance!")
+    prepared = dataset_cache().get_or_build(prepared_key, _prepare)
+    if mapping.date and mapping.date in df.columns and prepared.ts is None:
+        st.sidebar.warning("Could not parse date column properly.")
+    filtered, active_filters = render_global_filters(prepared, mapping, date_bounds=date_bounds,
+                                                      date_key=date_key)
+    if prepared.scan is not None and filtered is not prepared:
+        filtered.scan = parquet_scan(src, window, active_filters)
 
-    # Define tab names
-    tab_names = ["Overview", "Products", "Customers", "Customer Cohorts", "Customer Segments", "Forecast", "AI Assistant"]
-    
-    tabs = st.tabs(tab_names)
-    with tabs[0]:
-        render_overview_tab(filtered_df, results, mapping, active_filters)
-    with tabs[1]:
-        render_products_tab(filtered_df, results, mapping, active_filters)
-    with tabs[2]:
-        render_customers_tab(filtered_df, results, mapping, active_filters)
-    with tabs[3]:
-        render_cohorts_tab(filtered_df, results, mapping, active_filters)
-    with tabs[4]:
-        render_rfm_tab(filtered_df, results, mapping, active_filters)
-    with tabs[5]:
-        render_forecast_tab(filtered_df, results, mapping, active_filters)
-    with tabs[6]:
-        render_ai_tab(filtered_df, results, mapping, active_filters)
+    # Tag this run with its filter state: a newer state cancels
+    # insight work still running for the old one instead of letting it finish unseen
+    runs.start(st.session_state.setdefault("perf_session", uuid.uuid4().hex[:12]),
+               f"{data_key}|{sorted(mapping.to_dict().items())}|{rows_fingerprint(filtered.rows, len(filtered.source))}")
+
+    # Insights are computed lazily: each one runs the first time the active view
+    # (or an AI answer / the report) asks for it, then stays memoized for this selection
+    # and shared across reruns / sessions through the byte-bounded insight cache
+    service = {}
+    if executor == "service":
+        # workers memory-map the unfiltered arrays once and re-apply the sidebar filters themselves
+        service = {"service": worker_service(cfg), "filters": active_filters,
+                   "handle": publish(prepared, prepared_key, cfg["cache"].get("dir", ".omni_cache"))}
+    results = LazyResults(filtered, mapping, executor=executor, **service,
+                          max_workers=cfg["compute"].get("workers"),
+                          cache=insight_cache(cfg["limits"].get("insight_cache_mb")), dataset_fp=data_key,
+                          budgets=cfg["limits"].get("insight_budget_s"),
+                          degrade_opts={"sample_customers": cfg["limits"].get("degraded_sample_customers", 50000),
+                                        "last_cohorts": cfg["limits"].get("degraded_last_cohorts", 12)})
+    st.session_state["insights"] = results
+
+    # Only the selected view is rendered (st.tabs would build all seven every run)
+    # view -> (renderer, insights it reads; prefetched concurrently before drawing)
+    views = {
+        "Overview": (render_overview_tab, ("kpis", "trend")),
+        "Products": (render_products_tab, ("top_products", "bottom_products")),
+        "Customers": (render_customers_tab, ("repeat_rate",)),
+        "Customer Cohorts": (render_cohorts_tab, ("cohorts",)),
+        "Customer Segments": (render_rfm_tab, ("rfm",)),
+        "Forecast": (render_forecast_tab, ("forecast",)),
+        "AI Assistant": (render_ai_tab, tuple(results)),
+    }
+    view = st.radio("View", list(views), horizontal=True, key="active_view", label_visibility="collapsed")
+    render, needs = views[view]
+    try:
+        results.prefetch(needs)
+        render(filtered, results, mapping, active_filters)
+    except runs.Cancelled:
+        st.stop()  # superseded: the newer run takes over
 
     if export_btn:
         try:
-            path = export_html_report(filtered_df, results, mapping, active_filters)
+            path = export_html_report(filtered, results, mapping, active_filters)
             
             # Read the generated file for download
             with open(path, "r", encoding="utf-8") as f:
@@ -392,3 +553,36 @@ if df is not None and mapping is not None:
             st.info("Please try again or contact support if the issue persists.")
 else:
     st.info("Upload a dataset and confirm the mapping to continue.")
+
+# Performance panel: every instrumented call of this rerun (also appended to the JSONL log)
+perf_extra = {"view": st.session_state.get("active_view")}
+if df is not None and mapping is not None:
+    perf_extra["rows"] = len(filtered)
+    perf_extra["insights_computed"] = results.computed()
+    perf_extra["insights_cached"] = results.cached()
+    timings = results.timings()
+    perf_extra["critical_path"] = {k: timings[k] for k in ("critical_path", "critical_path_seconds", "critical_path_steps")}
+    if results.cache is not None:
+        perf_extra["insight_cache"] = results.cache.stats()
+perf_run = perf.finish_run(session=st.session_state.setdefault("perf_session", uuid.uuid4().hex[:12]), extra=perf_extra)
+if perf_run and perf_run["records"]:
+    with st.expander("⚡ Performance", expanded=False):
+        recs = pd.DataFrame(perf_run["records"])
+        st.caption(
+            f"This rerun: {perf_run['total_seconds']:.3f}s — slowest step: **{recs.loc[recs['seconds'].idxmax(), 'name']}** "
+            f"({recs['seconds'].max():.3f}s)" + ("" if perf_run["tracemalloc"] else " · peak memory off (perf.tracemalloc)")
+        )
+        cp = perf_extra.get("critical_path")
+        if cp and cp["critical_path"]:
+            # nodes run before the insights reading them: the longest chain bounds the insight wall time
+            st.caption("Critical path: " + " → ".join(f"{step} ({secs:.3f}s)" for step, secs in cp["critical_path_steps"])
+                       + f" = {cp['critical_path_seconds']:.3f}s")
+        cs = perf_extra.get("insight_cache")
+        if cs:
+            st.caption(
+                f"Insight cache: {cs['entries']} results, {cs['bytes'] / 1e6:.1f} / {cs['max_bytes'] / 1e6:.0f} MB — "
+                f"{cs['hits']} hits, {cs['misses']} misses, {cs['evictions']} evictions"
+                + (f" · served from cache this run: {', '.join(perf_extra['insights_cached'])}" if perf_extra["insights_cached"] else "")
+            )
+        st.dataframe(recs, use_container_width=True, hide_index=True)
+        st.bar_chart(recs.groupby("name", sort=False)["seconds"].sum().sort_values(ascending=False))
@@ -0,0 +1,233 @@
+"""
+core/cache.py
+In-process caches for OmniInsights.
+Parsed uploads are kept across Streamlit reruns so filter / tab changes never re-parse the file;
+insight results are kept per (dataset, mapping, filtered rows, insight, version).
+"""
+
+from __future__ import annotations
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+
+def estimate_bytes(obj: Any) -> int:
+    """Rough in-memory size of a cached value (DataFrames are measured exactly)."""
+    if isinstance(obj, pd.DataFrame):
+        try:
+            return int(obj.memory_usage(index=True, deep=True).sum())
+        except Exception:
+            return 0
+    if isinstance(obj, pd.Series):
+        try:
+            return int(obj.memory_usage(index=True, deep=True))
+        except Exception:
+            return 0
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if hasattr(obj, "nbytes"):  # numpy arrays, PreparedDataset
+        try:
+            return int(obj.nbytes)
+        except Exception:
+            return 0
+    if isinstance(obj, dict):
+        return sum(estimate_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_bytes(v) for v in obj)
+    return 64
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the estimated size of its values in bytes.
+    A single value larger than the whole budget is not stored.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = estimate_bytes):
+        self.max_bytes = int(max_bytes)
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """Store value; returns False if it does not fit in the budget."""
+        size = max(0, int(self._sizeof(value)))
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            if size > self.max_bytes:
+                return False
+            self._data[key] = (value, size)
+            self._bytes += size
+            self._evict()
+            return True
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """Return the cached value, building and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+    def resize(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._data:
+            _, (_, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# ---------------- Parsed upload cache ----------------
+_DATASETS: Optional[LRUCache] = None
+_DATASETS_LOCK = threading.Lock()
+
+
+def dataset_cache(max_mb: Optional[float] = None) -> LRUCache:
+    """Process-wide cache of parsed uploads (survives Streamlit reruns)."""
+    global _DATASETS
+    with _DATASETS_LOCK:
+        budget = int(float(max_mb if max_mb is not None else 1024) * 1024 * 1024)
+        if _DATASETS is None:
+            _DATASETS = LRUCache(budget)
+        elif max_mb is not None and _DATASETS.max_bytes != budget:
+            _DATASETS.resize(budget)
+        return _DATASETS
+
+
+_INSIGHTS: Optional[LRUCache] = None
+_INSIGHTS_LOCK = threading.Lock()
+
+
+def insight_cache(max_mb: Optional[float] = None) -> LRUCache:
+    """Process-wide cache of insight results, bounded by their estimated bytes."""
+    global _INSIGHTS
+    with _INSIGHTS_LOCK:
+        budget = int(float(max_mb if max_mb is not None else 256) * 1024 * 1024)
+        if _INSIGHTS is None:
+            _INSIGHTS = LRUCache(budget)
+        elif max_mb is not None and _INSIGHTS.max_bytes != budget:
+            _INSIGHTS.resize(budget)
+        return _INSIGHTS
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 of the raw upload bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_digest(f, memo: Optional[dict]) -> Tuple[str, int]:
+    """(SHA-256, size) of one uploaded file, memoized under Streamlit's file_id, which
+    stays the same across reruns for as long as the file is in the uploader."""
+    fid = getattr(f, "file_id", None)
+    if memo is not None and fid is not None and fid in memo:
+        return memo[fid]
+    data = f.getvalue()
+    digest = (content_hash(data), len(data))
+    if memo is not None and fid is not None:
+        memo[fid] = digest
+    return digest
+
+
+def upload_key(uploaded_file, memo: Optional[dict] = None) -> str:
+    """Identity of an upload: content hash + size + file name.
+    Multi-file uploads (core.io.MultiUpload) combine the hash of every uploaded file in
+    order, archives as uploaded (never inflated for the key). Pass a per-session dict
+    as `memo` so reruns hash only files that were not seen before."""
+    files = getattr(uploaded_file, "files", None)
+    if files is None:
+        digest, size = _file_digest(uploaded_file, memo)
+        return f"{digest}:{size}:{uploaded_file.name}"
+    h = hashlib.sha256()
+    for f in files:
+        digest, size = _file_digest(f, memo)
+        h.update(f"{f.name}:{size}:{digest}\n".encode())
+    return f"{h.hexdigest()}:{uploaded_file.size}:{uploaded_file.name}"
+
+
+def dataset_key(upload_id: str, variant: str = "") -> str:
+    """Cache key of a parsed upload (`upload_id` from upload_key). `variant`
+    distinguishes reads of the same file with different options (e.g. a column
+    projection or date window)."""
+    return f"{upload_id}|{variant}"
+
+
+def cached_read(
+    uploaded_file,
+    reader: Callable[[Any], pd.DataFrame],
+    max_mb: Optional[float] = None,
+    variant: str = "",
+    key: Optional[str] = None,
+    spill=None,
+) -> Tuple[pd.DataFrame, str]:
+    """
+    Return (df, origin) where origin is "memory", "disk" or "" (freshly parsed).
+    Parses with `reader` only when this exact upload is in neither the in-memory
+    cache nor the Parquet spill cache (core.spill.ParquetSpill, optional).
+    """
+    cache = dataset_cache(max_mb)
+    key = key or dataset_key(upload_key(uploaded_file), variant)
+    df = cache.get(key)
+    if df is not None:
+        return df, "memory"
+
+    # Content-addressed: same bytes + same read options, whatever the file name
+    spill_id = f"{key.split(':', 1)[0]}-{hashlib.sha256(variant.encode()).hexdigest()[:16]}"
+    is_parquet = uploaded_file.name.lower().endswith(".parquet")
+    if spill is not None and not is_parquet:
+        df = spill.load(spill_id)
+        if df is not None:
+            cache.put(key, df)
+            return df, "disk"
+
+    uploaded_file.seek(0)
+    df = reader(uploaded_file)
+    if spill is not None and not is_parquet:
+        spill.store(spill_id, df)
+    cache.put(key, df)
+    return df, ""
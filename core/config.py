@@ -16,10 +16,52 @@ DEFAULT_CONFIG = {
     "limits": {
         "max_rows": 500000,
         "max_file_size_mb": 50,
+        "dataset_cache_mb": 1024,
+        "insight_cache_mb": 256,
+        # seconds before cohorts / rfm / repeat_rate fall back to a degraded result (opt-in)
+        "insight_budget_s": {"default": None, "cohorts": None, "rfm": None, "repeat_rate": None},
+        "degraded_sample_customers": 50000,  # customers kept by the sampled fallbacks
+        "degraded_last_cohorts": 12,         # monthly cohorts kept by the cohorts fallback
+    },
+    "io": {
+        "csv_chunksize": 250000,
+        "dtype_backend": "numpy",  # "numpy" | "pyarrow"
+        "ingest_workers": None,    # processes for multi-file uploads (None = CPU count)
+    },
+    "compute": {
+        "executor": "thread",      # "serial" | "thread" | "process" | "service" for run_all / LazyResults
+        "workers": None,           # None = CPU count (capped at the number of insights)
+        "warm": True,              # service: spawn + warm the worker processes at app start
+        "engine": "pandas",        # "pandas" | "duckdb" | "polars" (insights.engine)
+        "duckdb_threads": None,    # None = DuckDB default
+        "duckdb_memory_limit": None,  # e.g. "4GB"; spills to <cache.dir>/duckdb_tmp past it
+        "cube": True,              # rollup cube per (day, product, channel) for filters and additive sums (core.cube)
+        "filter_index": True,      # sorted date index + per-value bitmaps for the sidebar filters (core.filter_index)
+    },
+    "perf": {
+        "enabled": True,           # time instrumented calls; Performance panel + JSONL log
+        "tracemalloc": False,      # also record peak memory (slows Python allocations)
+        "log": ".omni_cache/perf.jsonl",
+    },
+    "cache": {
+        "dir": ".omni_cache",
+        "max_disk_mb": 2048,
+        "spill": True,
     },
 }
 
 
+def _merge(base: dict, override: dict) -> dict:
+    """Recursively merge override into base (nested sections keep their defaults)."""
+    out = dict(base)
+    for k, v in override.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = _merge(out[k], v)
+        else:
+            out[k] = v
+    return out
+
+
 def load_config(path: str = None) -> dict:
     """
     Load configuration from YAML file if provided, else return defaults.
@@ -35,7 +77,7 @@ def load_config(path: str = None) -> dict:
         if not isinstance(data, dict):
             return DEFAULT_CONFIG
         # Merge with defaults
-        merged = {**DEFAULT_CONFIG, **data}
+        merged = _merge(DEFAULT_CONFIG, data)
         return merged
     except FileNotFoundError:
         return DEFAULT_CONFIG
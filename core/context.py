@@ -5,10 +5,13 @@ Designed to be fast and bounded in size.
 """
 
 from __future__ import annotations
-import hashlib
 from typing import Dict, Optional, Tuple, List
+import numpy as np
 import pandas as pd
 
+from core.perf import timed
+from core.prepared import PreparedDataset, prepare, month_label, sum_by_key
+
 try:
     import streamlit as st
 except Exception:  # streamlit optional for caching
@@ -19,18 +22,6 @@ def _safe_cols(df: pd.DataFrame, *cols) -> List[str]:
     return [c for c in cols if c and c in df.columns]
 
 
-def _df_signature(df: pd.DataFrame) -> str:
-    """Stable signature to invalidate cache when data changes (shape + head bytes)."""
-    try:
-        head = df.head(50).to_csv(index=False).encode("utf-8", errors="ignore")
-    except Exception:
-        head = b""
-    h = hashlib.sha256()
-    h.update(str(df.shape).encode())
-    h.update(head)
-    return h.hexdigest()
-
-
 def _format_money(x) -> str:
     try:
         return f"${float(x):,.0f}"
@@ -45,13 +36,19 @@ def _format_pct(x) -> str:
         return "—"
 
 
-def _monthly(df: pd.DataFrame, date_col: str, amount_col: str) -> pd.DataFrame:
-    d = df.copy()
-    d[date_col] = pd.to_datetime(d[date_col], errors="coerce")
-    d = d.dropna(subset=[date_col])
-    d["month"] = d[date_col].dt.to_period("M").astype(str)
-    g = d.groupby("month", as_index=False)[amount_col].sum().rename(columns={amount_col: "revenue"})
-    return g.sort_values("month").reset_index(drop=True)
+def _monthly(ds: PreparedDataset) -> pd.DataFrame:
+    """Revenue per month present in the data ("YYYY-MM" labels)."""
+    if ds.cube is not None:
+        g = ds.cube.monthly()
+        return pd.DataFrame({"month": month_label(g["month"].to_numpy()), "revenue": g["revenue"].to_numpy()})
+    ok = ds.ts_ok()
+    m = ds.month[ok]
+    if not len(m):
+        return pd.DataFrame({"month": [], "revenue": np.array([], dtype=float)})
+    lo = int(m.min())
+    sums, counts = sum_by_key(m - lo, np.nan_to_num(ds.amount[ok]), int(m.max()) - lo + 1)
+    seen = np.flatnonzero(counts)
+    return pd.DataFrame({"month": month_label(seen + lo), "revenue": sums[seen]})
 
 
 def _anomaly_last(trend: pd.DataFrame) -> Tuple[Optional[str], Optional[float]]:
@@ -72,17 +69,18 @@ def _kv_line(k: str, v) -> str:
     return f"- {k}: **{v}**"
 
 
-def _topn(df: pd.DataFrame, by_col: str, amount_col: str, n: int = 5) -> pd.DataFrame:
-    g = df.groupby(by_col, as_index=False)[amount_col].sum().rename(columns={amount_col: "revenue"})
+def _topn(ds: PreparedDataset, field: str, n: int = 5) -> pd.DataFrame:
+    g = ds.revenue_by(field).rename("revenue").reset_index()
     return g.sort_values("revenue", ascending=False).head(n).reset_index(drop=True)
 
 
-def _schema_snippet(df: pd.DataFrame, limit: int = 12) -> str:
+def _schema_snippet(ds: PreparedDataset, limit: int = 12) -> str:
     parts = []
-    for i, c in enumerate(df.columns[:limit]):
-        parts.append(f"- {c}: {str(df[c].dtype)}")
-    if df.shape[1] > limit:
-        parts.append(f"- … (+{df.shape[1]-limit} more)")
+    dtypes = ds.dtypes
+    for i, c in enumerate(ds.columns[:limit]):
+        parts.append(f"- {c}: {str(dtypes[c])}")
+    if ds.shape[1] > limit:
+        parts.append(f"- … (+{ds.shape[1]-limit} more)")
     return "\n".join(parts)
 
 
@@ -138,8 +136,9 @@ def _mk_context_markdown(
     return "\n".join(lines)
 
 
+@timed("build_context_pack")
 def build_context_pack(
-    df: pd.DataFrame,
+    data,                         # PreparedDataset (or DataFrame)
     mapping,                      # core.semantics.ColumnMapping
     max_trend_points: int = 12,
     top_n: int = 5
@@ -148,30 +147,22 @@ def build_context_pack(
     Build a compact Markdown context for the AI.
     Uses only aggregated info; no raw rows. Fast & bounded.
     """
-    if df is None or df.empty:
+    if data is None or data.empty:
         return "### KPIs\n- No data\n\n### Monthly Trend (compact)\n- n/a\n\n### Schema\n- n/a"
-
-    date_col, amt_col = mapping.date, mapping.amount
-    cid, prod, ch = mapping.customer_id, mapping.product, mapping.channel
+    ds = prepare(data, mapping)
+    has_amt = ds.has("amount")
 
     # KPIs
     k = {}
-    if amt_col and amt_col in df.columns:
-        k["total_sales"] = float(pd.to_numeric(df[amt_col], errors="coerce").fillna(0).sum())
-    if cid and cid in df.columns:
-        try: k["num_customers"] = int(df[cid].nunique())
-        except Exception: pass
-    if prod and prod in df.columns:
-        pass
+    if has_amt:
+        k["total_sales"] = ds.total()
+    if ds.has("customer_id"):
+        k["num_customers"] = ds.distinct("customer_id")
     # Orders
-    oid = getattr(mapping, "order_id", None)
-    if oid and oid in df.columns:
-        try:
-            k["num_orders"] = int(df[oid].nunique())
-        except Exception:
-            k["num_orders"] = int(df.shape[0]) if amt_col else None
+    if ds.has("order_id"):
+        k["num_orders"] = ds.distinct("order_id")
     else:
-        k["num_orders"] = int(df.shape[0]) if amt_col else None
+        k["num_orders"] = len(ds) if mapping.amount else None
 
     if k.get("total_sales") is not None and k.get("num_orders"):
         try:
@@ -182,8 +173,8 @@ def build_context_pack(
     # Trend
     trend = None
     trend_lines: List[str] = []
-    if date_col and amt_col and date_col in df.columns and amt_col in df.columns:
-        trend = _monthly(df, date_col, amt_col)
+    if ds.has("date", "amount"):
+        trend = _monthly(ds)
         for _, r in trend.tail(max_trend_points).iterrows():
             trend_lines.append(f"{r['month']}: {_format_money(r['revenue'])}")
 
@@ -191,10 +182,10 @@ def build_context_pack(
     m_anom, pc_anom = _anomaly_last(trend) if isinstance(trend, pd.DataFrame) else (None, None)
 
     # Tops
-    top_prod = _topn(df, prod, amt_col, n=top_n) if prod and prod in df.columns and amt_col in df.columns else None
-    top_chan = _topn(df, ch, amt_col, n=top_n) if ch and ch in df.columns and amt_col in df.columns else None
+    top_prod = _topn(ds, "product", n=top_n) if ds.has("product", "amount") else None
+    top_chan = _topn(ds, "channel", n=top_n) if ds.has("channel", "amount") else None
 
     # Schema
-    schema_md = _schema_snippet(df)
+    schema_md = _schema_snippet(ds)
 
     return _mk_context_markdown(k, trend_lines, top_prod, top_chan, schema_md, m_anom, pc_anom)
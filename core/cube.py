@@ -0,0 +1,166 @@
+"""
+core/cube.py
+Rollup cube: amount sums and row counts per (day, product, channel) cell of a
+PreparedDataset, built once per (data, mapping). Date / product / channel filters
+select cells alongside rows, and the additive aggregates (monthly revenue, revenue
+per product or channel, total sales, the filter options) are read from the selected
+cells instead of the rows. Distinct counts (orders, customers) do not add up across
+cells; they stay exact passes over the rows.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.perf import timed
+from core.prepared import NS_PER_DAY, PreparedDataset, sum_by_key
+
+# Coded fields the cube is broken down by (customer ids are too fine-grained to pay off)
+CUBE_DIMS = ("product", "channel")
+# Cubes with more cells than this fraction of the rows save too little to keep
+MAX_CELL_RATIO = 0.5
+# `day` of cells holding rows without a date
+UNDATED = np.iinfo(np.int32).min
+
+
+@dataclass
+class RollupCube:
+    """One entry per non-empty cell; take() selects cells like PreparedDataset.take selects rows."""
+    day: np.ndarray                     # int32 days since 1970-01-01 (UNDATED = no date)
+    month: np.ndarray                   # int32 months since 1970-01 (undefined where UNDATED)
+    midnight: np.ndarray                # bool: the cell's rows are stamped exactly 00:00
+    revenue: np.ndarray                 # float64 sum of amount (missing = 0)
+    rows: np.ndarray                    # int64 rows in the cell
+    priced: np.ndarray                  # int64 rows with an amount
+    codes: Dict[str, np.ndarray] = field(default_factory=dict)  # dim -> int32 code per cell (-1 = missing)
+    uniques: Dict[str, pd.Index] = field(default_factory=dict)  # shared with the dataset
+    amount_name: Optional[str] = None   # source amount column (name of revenue_by's Series)
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.day, self.month, self.midnight, self.revenue, self.rows, self.priced, *self.codes.values()]
+        return int(sum(a.nbytes for a in arrays))
+
+    def take(self, mask: np.ndarray) -> "RollupCube":
+        """Cell subset (positions or boolean mask)."""
+        return RollupCube(
+            day=self.day[mask], month=self.month[mask], midnight=self.midnight[mask],
+            revenue=self.revenue[mask], rows=self.rows[mask], priced=self.priced[mask],
+            codes={k: v[mask] for k, v in self.codes.items()}, uniques=self.uniques,
+            amount_name=self.amount_name,
+        )
+
+    # ---------------- filters (same rows as core.filters) ----------------
+    def in_dates(self, start, end) -> Optional[np.ndarray]:
+        """Cells of the rows with start <= ts <= end; None unless both bounds fall on midnight."""
+        lo = pd.Timestamp(start).value
+        hi = pd.Timestamp(end).value
+        if lo % NS_PER_DAY or hi % NS_PER_DAY:
+            return None
+        lo, hi = lo // NS_PER_DAY, hi // NS_PER_DAY
+        # the end day only contributes rows stamped at its first instant
+        return (self.day >= lo) & ((self.day < hi) | ((self.day == hi) & self.midnight))
+
+    def isin(self, f: str, values) -> Optional[np.ndarray]:
+        """Cells whose `f` label is in `values`; None when the cube is not broken down by `f`."""
+        if f not in self.codes:
+            return None
+        wanted = self.uniques[f].get_indexer(pd.Index(values))
+        return np.isin(self.codes[f], wanted[wanted >= 0])
+
+    # ---------------- aggregates ----------------
+    def seen(self, f: str) -> np.ndarray:
+        """Codes of `f` present in the cells (sorted)."""
+        c = self.codes[f]
+        return np.unique(c[c >= 0])
+
+    def date_bounds(self):
+        """(first day, last day) with dated rows, or None."""
+        d = self.day[self.day != UNDATED]
+        if not len(d):
+            return None
+        return tuple(pd.Timestamp(np.datetime64(int(x), "D")) for x in (d.min(), d.max()))
+
+    def total(self) -> float:
+        return float(self.revenue.sum())
+
+    def monthly(self) -> pd.DataFrame:
+        """Revenue, rows and priced rows per month key with dated rows (ascending)."""
+        ok = self.day != UNDATED
+        m = self.month[ok].astype(np.int64)
+        if not len(m):
+            return pd.DataFrame({"month": np.array([], dtype=np.int64), "revenue": np.array([], dtype=float),
+                                 "rows": np.array([], dtype=np.int64), "priced": np.array([], dtype=np.int64)})
+        lo = int(m.min())
+        n = int(m.max()) - lo + 1
+        sums, _ = sum_by_key(m - lo, self.revenue[ok], n)
+        rows = np.bincount(m - lo, weights=self.rows[ok], minlength=n).astype(np.int64)
+        priced = np.bincount(m - lo, weights=self.priced[ok], minlength=n).astype(np.int64)
+        seen = np.flatnonzero(rows)
+        return pd.DataFrame({"month": seen + lo, "revenue": sums[seen], "rows": rows[seen], "priced": priced[seen]})
+
+    def revenue_by(self, f: str) -> pd.Series:
+        """As PreparedDataset.revenue_by: amount per observed label of `f` (sorted)."""
+        c = self.codes[f]
+        ok = c >= 0
+        sums, counts = sum_by_key(c[ok], self.revenue[ok], len(self.uniques[f]))
+        seen = np.flatnonzero(counts)
+        return pd.Series(sums[seen], index=self.uniques[f].take(seen), name=self.amount_name)
+
+
+@timed("build_cube")
+def build_cube(ds: PreparedDataset) -> Optional[RollupCube]:
+    """Cube of every row of `ds`; None when it would not be much smaller than the rows."""
+    n = len(ds)
+    dims = [f for f in CUBE_DIMS if f in ds.codes]
+    # mixed-radix cell key: (day, midnight, dims...) with every part shifted to >= 0
+    key = np.zeros(n, dtype=np.int64)
+    radix = []
+    if ds.ts is not None and n:
+        ok = ds.ts_ok()
+        lo = int(ds.day[ok].min()) if ok.any() else 0
+        hi = int(ds.day[ok].max()) if ok.any() else 0
+        day = np.where(ok, ds.day.astype(np.int64) - lo + 1, 0)  # 0 = undated
+        midnight = ok & (ds.ts.view(np.int64) % NS_PER_DAY == 0)
+        radix += [(day, hi - lo + 2), (midnight.astype(np.int64), 2)]
+    for f in dims:
+        radix.append((ds.codes[f].astype(np.int64) + 1, len(ds.uniques[f]) + 1))
+    if np.prod([float(size) for _, size in radix]) >= 2.0 ** 62:
+        return None
+    for part, size in radix:
+        key = key * size + part
+    cells, inverse = np.unique(key, return_inverse=True)
+    if n and len(cells) > MAX_CELL_RATIO * n:
+        return None
+
+    # decode the cell keys back into their parts (last part first)
+    parts = []
+    rest = cells
+    for _, size in reversed(radix):
+        rest, part = np.divmod(rest, size)
+        parts.append(part)
+    parts.reverse()
+    if ds.ts is not None and n:
+        day = np.where(parts[0] > 0, parts[0] + lo - 1, UNDATED).astype(np.int32)
+        midnight = parts[1].astype(bool)
+        coded = parts[2:]
+    else:
+        day = np.full(len(cells), UNDATED, dtype=np.int32)
+        midnight = np.zeros(len(cells), dtype=bool)
+        coded = parts
+    month = np.where(day != UNDATED, day, 0).astype("datetime64[D]").astype("datetime64[M]").astype(np.int32)
+
+    amount = ds.amount if ds.amount is not None else np.zeros(n)
+    revenue, rows = sum_by_key(inverse, np.nan_to_num(amount), len(cells))
+    priced = np.bincount(inverse, weights=~np.isnan(amount), minlength=len(cells)).astype(np.int64)
+    return RollupCube(
+        day=day, month=month, midnight=midnight, revenue=revenue, rows=rows.astype(np.int64), priced=priced,
+        codes={f: (p - 1).astype(np.int32) for f, p in zip(dims, coded)}, uniques=ds.uniques,
+        amount_name=ds.col("amount"),
+    )
@@ -0,0 +1,93 @@
+"""
+core/filter_index.py
+Index for the sidebar filters, built once per (data, mapping): the dated rows sorted
+by timestamp, so a date range is two binary searches, and the row positions of every
+product / channel / customer. Each filter turns into a packed bitmap (1 bit per row);
+the sidebar ANDs them and takes the selected rows once.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.perf import timed
+from core.prepared import PreparedDataset
+
+# Coded fields with a per-value index
+INDEXED_FIELDS = ("product", "channel", "customer_id")
+
+
+@dataclass
+class FilterIndex:
+    """Row positions of one dataset grouped by timestamp and by label."""
+    n: int
+    ts: Optional[np.ndarray] = None       # int64 ns of the dated rows, ascending
+    by_ts: Optional[np.ndarray] = None    # their row positions (None = every row, already in time order)
+    # field -> (offsets per code, row positions grouped by code); code c owns positions[offsets[c]:offsets[c+1]]
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = field(default_factory=dict)
+    uniques: Dict[str, pd.Index] = field(default_factory=dict)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.ts, self.by_ts, *(a for p in self.postings.values() for a in p)]
+        return int(sum(a.nbytes for a in arrays if a is not None))
+
+    def _bitmap(self, positions: np.ndarray) -> np.ndarray:
+        m = np.zeros(self.n, dtype=bool)
+        m[positions] = True
+        return np.packbits(m)
+
+    def dates(self, start, end) -> np.ndarray:
+        """Bitmap of the rows with start <= ts <= end (as core.filters._in_dates)."""
+        lo = np.searchsorted(self.ts, pd.to_datetime(start).value, side="left")
+        hi = np.searchsorted(self.ts, pd.to_datetime(end).value, side="right")
+        if self.by_ts is not None:
+            return self._bitmap(self.by_ts[lo:hi])
+        m = np.zeros(self.n, dtype=bool)
+        m[lo:hi] = True
+        return np.packbits(m)
+
+    def isin(self, f: str, values) -> np.ndarray:
+        """Bitmap of the rows whose `f` label is in `values` (as core.filters._isin)."""
+        offsets, positions = self.postings[f]
+        wanted = np.unique(self.uniques[f].get_indexer(pd.Index(values)))
+        wanted = wanted[wanted >= 0]
+        return self._bitmap(np.concatenate([positions[offsets[c]:offsets[c + 1]] for c in wanted] or
+                                           [np.array([], dtype=np.intp)]))
+
+    def seen(self, f: str) -> np.ndarray:
+        """Codes of `f` with at least one row."""
+        return np.flatnonzero(np.diff(self.postings[f][0]))
+
+    def rows(self, bitmap: np.ndarray) -> np.ndarray:
+        """Ascending row positions set in `bitmap`."""
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.n).view(bool))
+
+
+def _positions(n: int) -> np.dtype:
+    return np.int32 if n < 2**31 else np.int64
+
+
+@timed("build_filter_index")
+def build_filter_index(ds: PreparedDataset) -> FilterIndex:
+    n = len(ds)
+    idx = FilterIndex(n=n, uniques=ds.uniques)
+    if ds.ts is not None:
+        ts = ds.ts.view(np.int64)
+        dated = np.flatnonzero(~np.isnat(ds.ts)).astype(_positions(n))
+        order = dated[np.argsort(ts[dated], kind="stable")]
+        idx.ts = ts[order]
+        # uploads are often sorted by date already: then a range is one contiguous slice
+        idx.by_ts = None if len(order) == n and np.array_equal(order, np.arange(n)) else order
+    for f in INDEXED_FIELDS:
+        if f in ds.codes:
+            c = ds.codes[f]
+            order = np.argsort(c, kind="stable").astype(_positions(n))
+            counts = np.bincount(c + 1, minlength=len(ds.uniques[f]) + 1)
+            # drop the leading group of missing values (-1); offsets index codes 0..k
+            offsets = np.concatenate([[0], np.cumsum(counts[1:])]) + counts[0]
+            idx.postings[f] = (offsets, order)
+    return idx
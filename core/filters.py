@@ -3,63 +3,186 @@ core/filters.py
 Global filtering widgets for OmniInsights.
 """
 
+import numpy as np
 import streamlit as st
 import pandas as pd
+from core.io import ParquetScan
 from core.semantics import ColumnMapping
+from core.prepared import PreparedDataset
+from core.perf import timed
 
 
-def render_global_filters(df: pd.DataFrame, mapping: ColumnMapping):
+# Session key prefix of the date picker; loaders read it to push the window into scans
+DATE_RANGE_KEY = "filter_date_range"
+
+
+def date_range_key(upload_id: str) -> str:
+    """Date picker key for one upload, so a new file does not inherit the previous range."""
+    return f"{DATE_RANGE_KEY}:{upload_id}"
+
+
+def _options(ds: PreparedDataset, field: str) -> list:
+    """Sorted distinct labels of a coded field present in the current rows."""
+    c = ds.codes[field]
+    seen = np.flatnonzero(np.bincount(c[c >= 0], minlength=len(ds.uniques[field])))
+    return sorted(ds.labels(field, seen).tolist())
+
+
+def _isin(ds: PreparedDataset, field: str, values) -> np.ndarray:
+    wanted = ds.uniques[field].get_indexer(pd.Index(values))
+    return np.isin(ds.codes[field], wanted[wanted >= 0])
+
+
+def _in_dates(ds: PreparedDataset, start, end) -> np.ndarray:
+    lo = np.datetime64(pd.to_datetime(start), "ns")
+    hi = np.datetime64(pd.to_datetime(end), "ns")
+    return (ds.ts >= lo) & (ds.ts <= hi)
+
+
+# active_filters key -> mapping field it restricts
+_SELECTIONS = {"products": "product", "channels": "channel", "customers": "customer_id"}
+
+
+class _Selection:
+    """
+    Filters applied so far to `ds`, in sidebar order. With a FilterIndex each filter is
+    a packed bitmap ANDed into the selection and the rows are taken once at the end;
+    without one every filter takes its rows as it goes. The rollup cube's cells are
+    narrowed alongside while the filters map onto them.
+    """
+
+    def __init__(self, ds: PreparedDataset):
+        self.ds = ds              # view so far (the unfiltered dataset while bitmaps are pending)
+        self.index = ds.index
+        self.bits = None          # packed bitmap over ds (index path), None = every row
+        self.cube = ds.cube
+        self._rows = None         # positions set in bits (cached between option lists and result)
+
+    def _apply(self, index_bits, mask, cells) -> None:
+        self.cube = self.cube.take(cells) if self.cube is not None and cells is not None else None
+        if self.index is not None:
+            bits = index_bits()
+            self.bits = bits if self.bits is None else self.bits & bits
+            self._rows = None
+        else:
+            self.ds = self.ds.take(mask(), cube=self.cube)
+
+    def dates(self, start, end) -> None:
+        self._apply(lambda: self.index.dates(start, end), lambda: _in_dates(self.ds, start, end),
+                    self.cube.in_dates(start, end) if self.cube is not None else None)
+
+    def isin(self, f: str, values) -> None:
+        self._apply(lambda: self.index.isin(f, values), lambda: _isin(self.ds, f, values),
+                    self.cube.isin(f, values) if self.cube is not None else None)
+
+    def date_bounds(self):
+        """(first, last) timestamp of the dated rows before any filter."""
+        if self.cube is not None:
+            return self.cube.date_bounds() or (pd.NaT, pd.NaT)
+        if self.index is not None:
+            ts = self.index.ts
+            return (pd.Timestamp(ts[0]), pd.Timestamp(ts[-1])) if len(ts) else (pd.NaT, pd.NaT)
+        ok = self.ds.ts_ok()
+        return (pd.Timestamp(self.ds.ts[ok].min()), pd.Timestamp(self.ds.ts[ok].max())) if ok.any() else (pd.NaT, pd.NaT)
+
+    def options(self, f: str) -> list:
+        """Sorted labels of `f` present in the selected rows."""
+        if self.cube is not None and f in self.cube.codes:
+            return sorted(self.ds.labels(f, self.cube.seen(f)).tolist())
+        if self.bits is None:
+            if self.index is not None and f in self.index.postings:
+                return sorted(self.ds.labels(f, self.index.seen(f)).tolist())
+            return _options(self.ds, f)
+        c = self.ds.codes[f][self._selected()]
+        seen = np.flatnonzero(np.bincount(c[c >= 0], minlength=len(self.ds.uniques[f])))
+        return sorted(self.ds.labels(f, seen).tolist())
+
+    def _selected(self) -> np.ndarray:
+        if self._rows is None:
+            self._rows = self.index.rows(self.bits)
+        return self._rows
+
+    def result(self) -> PreparedDataset:
+        if self.bits is None:
+            return self.ds
+        return self.ds.take(self._selected(), cube=self.cube)
+
+
+def apply_filters(ds: PreparedDataset, active_filters: dict) -> PreparedDataset:
+    """
+    Re-apply an active_filters dict (as returned by render_global_filters) to `ds`
+    without any widgets, e.g. in a worker process that only received the filters.
+    Selects the same rows as the sidebar did.
+    """
+    sel = _Selection(ds)
+    if active_filters.get("date_range") and ds.has("date"):
+        sel.dates(*active_filters["date_range"])
+    for key, f in _SELECTIONS.items():
+        if active_filters.get(key) and ds.has(f):
+            sel.isin(f, active_filters[key])
+    return sel.result()
+
+
+def parquet_scan(path, window=None, active_filters=None) -> ParquetScan:
+    """The rows apply_filters(active_filters) selects from a read_parquet_window(path,
+    window=...) load, as a ParquetScan."""
+    active_filters = active_filters or {}
+    return ParquetScan(str(path), tuple(window) if window else None, active_filters.get("date_range"),
+                       {f: list(active_filters[k]) for k, f in _SELECTIONS.items() if active_filters.get(k)})
+
+
+@timed("render_global_filters")
+def render_global_filters(ds: PreparedDataset, mapping: ColumnMapping, date_bounds=None,
+                          date_key: str = DATE_RANGE_KEY):
     """
     Render global filters in the sidebar.
-    Returns (filtered_df, active_filters_dict).
+    `date_bounds` overrides the range offered by the date picker (e.g. Parquet
+    statistics when only a window of the file was loaded); `date_key` is the
+    picker's session key (see date_range_key).
+    Returns (filtered_dataset, active_filters_dict).
     """
     active_filters = {}
-
-    # Work on a copy
-    fdf = df.copy()
+    fsel = _Selection(ds)
 
     st.sidebar.header("Filters")
 
     # Date filter
-    if mapping.date and mapping.date in fdf.columns:
+    if ds.has("date"):
         try:
-            fdf[mapping.date] = pd.to_datetime(fdf[mapping.date], errors="coerce")
-            min_date, max_date = fdf[mapping.date].min(), fdf[mapping.date].max()
+            if date_bounds:
+                min_date, max_date = date_bounds
+            else:
+                min_date, max_date = fsel.date_bounds()
             start, end = st.sidebar.date_input(
                 "Date range",
                 [min_date, max_date] if min_date and max_date else None,
+                key=date_key,
             )
             if start and end:
-                mask = (fdf[mapping.date] >= pd.to_datetime(start)) & (
-                    fdf[mapping.date] <= pd.to_datetime(end)
-                )
-                fdf = fdf.loc[mask]
+                fsel.dates(start, end)
                 active_filters["date_range"] = (str(start), str(end))
         except Exception:
             st.sidebar.warning("Could not parse date column properly.")
 
     # Product filter
-    if mapping.product and mapping.product in fdf.columns:
-        options = sorted(fdf[mapping.product].dropna().unique().tolist())
-        sel = st.sidebar.multiselect("Products", options)
+    if ds.has("product"):
+        sel = st.sidebar.multiselect("Products", fsel.options("product"))
         if sel:
-            fdf = fdf[fdf[mapping.product].isin(sel)]
+            fsel.isin("product", sel)
             active_filters["products"] = sel
 
     # Channel filter
-    if mapping.channel and mapping.channel in fdf.columns:
-        options = sorted(fdf[mapping.channel].dropna().unique().tolist())
-        sel = st.sidebar.multiselect("Channels", options)
+    if ds.has("channel"):
+        sel = st.sidebar.multiselect("Channels", fsel.options("channel"))
         if sel:
-            fdf = fdf[fdf[mapping.channel].isin(sel)]
+            fsel.isin("channel", sel)
             active_filters["channels"] = sel
 
     # Customer filter
-    if mapping.customer_id and mapping.customer_id in fdf.columns:
-        options = sorted(fdf[mapping.customer_id].dropna().unique().tolist())
-        sel = st.sidebar.multiselect("Customers", options)
+    if ds.has("customer_id"):
+        sel = st.sidebar.multiselect("Customers", fsel.options("customer_id"))
         if sel:
-            fdf = fdf[fdf[mapping.customer_id].isin(sel)]
+            fsel.isin("customer_id", sel)
             active_filters["customers"] = sel
 
-    return fdf, active_filters
+    return fsel.result(), active_filters
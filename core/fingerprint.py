@@ -0,0 +1,95 @@
+"""
+core/fingerprint.py
+Stable content fingerprints for DataFrames and PreparedDataset views.
+Unlike Python's hash() (salted per process) the digests are identical in every
+process, so they can key caches shared across reruns, sessions and workers.
+"""
+
+from __future__ import annotations
+import hashlib
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# "auto" hashes every row up to this many rows, block samples above it
+FULL_MAX_ROWS = 1_000_000
+SAMPLE_BLOCKS = 64
+BLOCK_ROWS = 256
+
+# id(frame) -> (weakref, mode, digest); frames are treated as immutable once loaded.
+# An id can be reused once its frame is gone, so hits are checked against the weakref.
+# Written from insight pool threads and weakref callbacks; the lock is reentrant because
+# a callback can run during garbage collection on a thread that already holds it.
+_MEMO: Dict[int, Tuple[weakref.ref, str, str]] = {}
+_MEMO_LOCK = threading.RLock()
+
+
+def _forget(ref: weakref.ref, key: int) -> None:
+    """Weakref callback: drop the entry of a collected frame, unless a newer frame
+    with the same id has replaced it already."""
+    with _MEMO_LOCK:
+        hit = _MEMO.get(key)
+        if hit is not None and hit[0] is ref:
+            del _MEMO[key]
+
+
+def _row_hashes(df: pd.DataFrame) -> np.ndarray:
+    try:
+        return pd.util.hash_pandas_object(df, index=True).to_numpy()
+    except TypeError:  # unhashable cells (lists, dicts)
+        return pd.util.hash_pandas_object(df.astype(str), index=True).to_numpy()
+
+
+def fingerprint(df: pd.DataFrame, mode: str = "auto") -> str:
+    """
+    Hex digest of a frame's schema and values.
+    mode="full" hashes every row (exact, O(n)); mode="sample" hashes SAMPLE_BLOCKS
+    evenly spaced blocks of BLOCK_ROWS rows including the first and last rows
+    (O(n / k); an edit outside the sampled blocks goes unnoticed). "auto" picks
+    full up to FULL_MAX_ROWS rows.
+    """
+    if mode not in ("auto", "full", "sample"):
+        raise ValueError(f"Unknown fingerprint mode {mode!r}")
+    key = id(df)
+    with _MEMO_LOCK:
+        hit = _MEMO.get(key)
+    if hit is not None and hit[0]() is df and hit[1] == mode:
+        return hit[2]
+
+    n = len(df)
+    sampled = mode == "sample" or (mode == "auto" and n > FULL_MAX_ROWS)
+    sampled = sampled and n > SAMPLE_BLOCKS * BLOCK_ROWS
+    part = df
+    if sampled:
+        starts = np.linspace(0, n - BLOCK_ROWS, SAMPLE_BLOCKS).astype(np.int64)
+        part = df.iloc[(starts[:, None] + np.arange(BLOCK_ROWS)).ravel()]
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((sampled, df.shape, [str(c) for c in df.columns], [str(t) for t in df.dtypes])).encode())
+    h.update(_row_hashes(part).tobytes())
+    digest = h.hexdigest()
+
+    try:
+        ref = weakref.ref(df, lambda r, k=key: _forget(r, k))
+    except TypeError:
+        return digest
+    with _MEMO_LOCK:
+        _MEMO[key] = (ref, mode, digest)
+    return digest
+
+
+def rows_fingerprint(rows: Optional[np.ndarray], n_source: Optional[int] = None) -> str:
+    """Digest of selected row positions ("all" when every one of `n_source` rows is kept)."""
+    if rows is None or (n_source is not None and len(rows) == n_source):
+        return "all"
+    return hashlib.blake2b(np.asarray(rows, dtype=np.int64).tobytes(), digest_size=16).hexdigest()
+
+
+def dataset_fingerprint(data, mode: str = "auto") -> str:
+    """Fingerprint of a DataFrame, or of a PreparedDataset view (source frame + selected rows)."""
+    if isinstance(data, pd.DataFrame):
+        return fingerprint(data, mode)
+    return f"{fingerprint(data.source, mode)}:{rows_fingerprint(data.rows, len(data.source))}"
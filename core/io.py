@@ -1,9 +1,49 @@
 """
 core/io.py
-Safe file readers for OmniInsights (CSV, Excel, Parquet).
+Safe file readers for OmniInsights (CSV incl. gzip/bz2/zstd, Excel, Parquet).
 """
 
+import bz2
+import datetime as dt
+import gzip
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
 import pandas as pd
+from pandas.api import types as ptypes
+from pandas.api.types import union_categoricals
+
+from core.perf import timed
+
+try:
+    import python_calamine  # noqa: F401  (optional: fast Rust Excel reader, pandas engine="calamine")
+    # pandas gained the calamine engine in 2.2
+    if tuple(int(p) for p in pd.__version__.split(".")[:2]) < (2, 2):
+        python_calamine = None
+except Exception:
+    python_calamine = None
+
+try:
+    import zstandard  # optional: .zst uploads
+except Exception:
+    zstandard = None
+
+try:
+    import pyarrow  # noqa: F401  (optional: Arrow-backed dtypes, Parquet scans)
+    import pyarrow.dataset as pads
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except Exception:
+    pyarrow = pads = pafs = pq = None
+
+DEFAULT_CHUNKSIZE = 250_000
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx", ".xls", ".parquet") + tuple(".csv" + ext for ext in COMPRESSIONS)
 
 
 def infer_sep(sample: bytes) -> str:
@@ -20,27 +60,492 @@ def infer_sep(sample: bytes) -> str:
     return ","
 
 
-def read_any(uploaded_file) -> pd.DataFrame:
+# ---------------- Compressed CSV ----------------
+def compression_of(name: str) -> Optional[str]:
+    """Codec implied by the file name ("gzip" / "bz2" / "zstd"), or None."""
+    return COMPRESSIONS.get(os.path.splitext(name.lower())[1])
+
+
+def is_csv(name: str) -> bool:
+    """True for .csv files, compressed or not."""
+    name = name.lower()
+    if compression_of(name):
+        name = os.path.splitext(name)[0]
+    return name.endswith(".csv")
+
+
+def open_decompressed(uploaded_file, codec: str):
+    """Streaming reader over the decompressed bytes, from the current position (never inflated in full)."""
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=uploaded_file, mode="rb")
+    if codec == "bz2":
+        return bz2.BZ2File(uploaded_file, mode="rb")
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("Reading .zst files requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().stream_reader(uploaded_file, read_across_frames=True, closefd=False)
+    raise ValueError(f"Unsupported compression: {codec}")
+
+
+class _Meter(io.RawIOBase):
+    """Raw reader over `raw` counting the bytes read and the seconds spent reading."""
+
+    def __init__(self, raw):
+        super().__init__()
+        self.raw = raw
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        t = time.perf_counter()
+        data = self.raw.read(len(b))
+        self.seconds += time.perf_counter() - t
+        n = len(data)
+        b[:n] = data
+        self.bytes += n
+        return n
+
+
+def _ingest_stats(compressed: _Meter, parsed: _Meter, seconds: float) -> dict:
+    """Throughput of one compressed read; parse time is the wall time not spent decompressing."""
+    mb = 1024 * 1024
+    parse_s = max(seconds - parsed.seconds, 1e-9)
+    return {
+        "compressed_mb": compressed.bytes / mb,
+        "parsed_mb": parsed.bytes / mb,
+        "seconds": seconds,
+        "decompress_seconds": parsed.seconds,
+        "parse_seconds": parse_s,
+        "compressed_mb_s": compressed.bytes / mb / max(parsed.seconds, 1e-9),
+        "parsed_mb_s": parsed.bytes / mb / parse_s,
+    }
+
+
+def _peek_sep(uploaded_file) -> str:
+    codec = compression_of(getattr(uploaded_file, "name", ""))
+    if codec:
+        uploaded_file.seek(0)
+        with open_decompressed(uploaded_file, codec) as s:
+            sample = s.read(2048)
+    else:
+        sample = uploaded_file.read(2048)
+    uploaded_file.seek(0)
+    return infer_sep(sample)
+
+
+def read_csv_header(uploaded_file) -> List[str]:
+    """Return the column names of a CSV (optionally compressed) without parsing any rows."""
+    sep = _peek_sep(uploaded_file)
+    codec = compression_of(getattr(uploaded_file, "name", ""))
+    if codec:
+        uploaded_file.seek(0)
+        with open_decompressed(uploaded_file, codec) as s:
+            cols = list(pd.read_csv(s, sep=sep, nrows=0).columns)
+    else:
+        cols = list(pd.read_csv(uploaded_file, sep=sep, nrows=0).columns)
+    uploaded_file.seek(0)
+    return cols
+
+
+def _backend_kwargs(dtype_backend: Optional[str]) -> dict:
+    """pandas kwargs for the requested dtype backend ("numpy" or "pyarrow")."""
+    if dtype_backend == "pyarrow" and pyarrow is not None:
+        return {"dtype_backend": "pyarrow"}
+    return {}
+
+
+def _compact_chunk(chunk: pd.DataFrame, date_cols: Iterable[str], numeric_cols: Iterable[str]) -> pd.DataFrame:
+    for c in date_cols:
+        if c in chunk.columns:
+            chunk[c] = pd.to_datetime(chunk[c], errors="coerce")
+    for c in numeric_cols:
+        if c in chunk.columns:
+            chunk[c] = pd.to_numeric(chunk[c], errors="coerce")
+    for c in chunk.columns:
+        if chunk[c].dtype == object:
+            chunk[c] = chunk[c].astype("category")
+    return chunk
+
+
+def read_csv_streaming(
+    uploaded_file,
+    usecols: Optional[Iterable[str]] = None,
+    date_cols: Iterable[str] = (),
+    numeric_cols: Iterable[str] = (),
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    dtype_backend: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Read a CSV in chunks, keeping only `usecols`. Dates and amounts are parsed
+    per chunk and text columns become categoricals (or Arrow strings with the
+    pyarrow backend), so peak memory stays close to the size of the final
+    compact frame.
+    .gz / .bz2 / .zst files are decompressed on the fly into the chunk reader;
+    their throughput is recorded in df.attrs["ingest"].
+    """
+    sep = _peek_sep(uploaded_file)
+    if usecols is not None:
+        header = set(read_csv_header(uploaded_file))
+        usecols = [c for c in dict.fromkeys(usecols) if c and c in header]
+    date_cols, numeric_cols = list(date_cols), list(numeric_cols)
+
+    codec = compression_of(getattr(uploaded_file, "name", ""))
+    source = uploaded_file
+    if codec:
+        uploaded_file.seek(0)
+        compressed = _Meter(uploaded_file)
+        parsed = _Meter(open_decompressed(compressed, codec))
+        source = io.BufferedReader(parsed, buffer_size=1 << 20)
+    t0 = time.perf_counter()
+
+    chunks = []
+    reader = pd.read_csv(
+        source, sep=sep, usecols=usecols, chunksize=max(1, int(chunksize)), **_backend_kwargs(dtype_backend)
+    )
+    for chunk in reader:
+        chunks.append(_compact_chunk(chunk, date_cols, numeric_cols))
+    df = align_frames(chunks)  # same dtype reconciliation as multi-file uploads
+    if codec:
+        df.attrs["ingest"] = dict(_ingest_stats(compressed, parsed, time.perf_counter() - t0), codec=codec)
+        uploaded_file.seek(0)
+    return df
+
+
+# ---------------- Parquet scans (memory-mapped, pushdown) ----------------
+def _parquet_dataset(path: str):
+    return pads.dataset(str(path), format="parquet", filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+def parquet_columns(path: str) -> List[str]:
+    """Column names from the Parquet footer (no data read)."""
+    return list(pq.ParquetFile(str(path)).schema_arrow.names)
+
+
+def parquet_date_bounds(path: str, date_col: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """(min, max) of a date/timestamp column from row-group statistics, or None."""
+    if pq is None or not date_col:
+        return None
+    try:
+        pf = pq.ParquetFile(str(path))
+        idx = pf.schema_arrow.get_field_index(date_col)
+        if idx < 0:
+            return None
+        typ = pf.schema_arrow.field(idx).type
+        if not (pyarrow.types.is_timestamp(typ) or pyarrow.types.is_date(typ)):
+            return None
+        lo = hi = None
+        for i in range(pf.metadata.num_row_groups):
+            st = pf.metadata.row_group(i).column(idx).statistics
+            if st is None or not st.has_min_max:
+                return None
+            lo = st.min if lo is None else min(lo, st.min)
+            hi = st.max if hi is None else max(hi, st.max)
+        if lo is None:
+            return None
+        return pd.Timestamp(lo).tz_localize(None), pd.Timestamp(hi).tz_localize(None)
+    except Exception:
+        return None
+
+
+def _date_expr(dataset, date_col: str, date_range):
+    """start <= date < end + 1 day, typed to the column; None if the column is not a date."""
+    typ = dataset.schema.field(date_col).type
+    start = pd.Timestamp(date_range[0]).normalize()
+    stop = pd.Timestamp(date_range[1]).normalize() + pd.Timedelta(days=1)
+    if pyarrow.types.is_timestamp(typ):
+        if typ.tz:
+            start, stop = start.tz_localize(typ.tz), stop.tz_localize(typ.tz)
+        lo, hi = pyarrow.scalar(start.to_pydatetime(), typ), pyarrow.scalar(stop.to_pydatetime(), typ)
+    elif pyarrow.types.is_date(typ):
+        lo, hi = pyarrow.scalar(start.date(), typ), pyarrow.scalar(stop.date(), typ)
+    else:
+        return None
+    return (pads.field(date_col) >= lo) & (pads.field(date_col) < hi)
+
+
+@timed("read_parquet_window")
+def read_parquet_window(
+    path: str,
+    columns: Optional[Iterable[str]] = None,
+    date_col: Optional[str] = None,
+    date_range: Optional[Tuple[dt.date, dt.date]] = None,
+    dtype_backend: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Scan a local Parquet file through a memory-mapped pyarrow dataset, reading
+    only `columns` and, when the date column is typed, only rows (and row groups)
+    inside `date_range` (inclusive days).
+    """
+    dataset = _parquet_dataset(path)
+    names = set(dataset.schema.names)
+    cols = [c for c in dict.fromkeys(columns) if c and c in names] if columns is not None else None
+    expr = None
+    if date_range and date_col and date_col in names:
+        expr = _date_expr(dataset, date_col, date_range)
+    table = dataset.to_table(columns=cols, filter=expr)
+    if dtype_backend == "pyarrow":
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas()
+
+
+@dataclass(frozen=True)
+class ParquetScan:
     """
-    Read a file uploaded via Streamlit (UploadedFile).
-    Supports CSV, Excel (xls/xlsx), and Parquet.
+    The rows of a dataset read with read_parquet_window, as a scan of the file: the
+    load window plus the sidebar selections (see core.filters.parquet_scan). Engines
+    that read Parquet themselves push these predicates into their own scan.
     """
+    path: str
+    window: Optional[Tuple[dt.date, dt.date]] = None      # read_parquet_window's date_range
+    date_range: Optional[Tuple[str, str]] = None          # sidebar range: start <= ts <= end
+    labels: Dict[str, list] = field(default_factory=dict)  # mapping field -> selected labels
+
+
+# ---------------- Excel ----------------
+def excel_engine(name: str) -> Optional[str]:
+    """calamine when installed; otherwise openpyxl (read-only mode) for .xlsx, pandas' default for .xls."""
+    if python_calamine is not None:
+        return "calamine"
+    return "openpyxl" if name.lower().endswith(".xlsx") else None
+
+
+def excel_sheets(uploaded_file) -> List[str]:
+    """Sheet names of a workbook (no cell data parsed)."""
+    with pd.ExcelFile(uploaded_file, engine=excel_engine(uploaded_file.name)) as xl:
+        names = list(xl.sheet_names)
+    uploaded_file.seek(0)
+    return names
+
+
+def excel_header(uploaded_file, sheets: Optional[List] = None) -> List[str]:
+    """Union of the header rows of the given sheets (first sheet by default)."""
+    engine = excel_engine(uploaded_file.name)
+    cols = []
+    for sheet in sheets or [0]:
+        uploaded_file.seek(0)
+        cols.extend(pd.read_excel(uploaded_file, sheet_name=sheet, nrows=0, engine=engine).columns)
+    uploaded_file.seek(0)
+    return list(dict.fromkeys(cols))
+
+
+def _read_sheet(data: bytes, name: str, sheet, usecols, backend: dict) -> pd.DataFrame:
+    wanted = set(usecols) if usecols is not None else None
+    return pd.read_excel(
+        io.BytesIO(data),
+        sheet_name=sheet,
+        engine=excel_engine(name),
+        usecols=(lambda c: c in wanted) if wanted is not None else None,
+        **backend,
+    )
+
+
+def read_excel_fast(
+    uploaded_file,
+    sheets: Optional[List] = None,
+    usecols: Optional[Iterable[str]] = None,
+    dtype_backend: Optional[str] = None,
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Read a workbook with the fastest available engine, keeping only `usecols`.
+    Several sheets are parsed in parallel on a process pool and unioned.
+    """
+    data, name = uploaded_file.getvalue(), uploaded_file.name
+    usecols = list(usecols) if usecols is not None else None
+    backend = _backend_kwargs(dtype_backend)
+    sheets = list(sheets) if sheets else [0]
+    if len(sheets) == 1:
+        return _read_sheet(data, name, sheets[0], usecols, backend)
+    workers = min(len(sheets), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        frames = [_read_sheet(data, name, sh, usecols, backend) for sh in sheets]
+    else:
+        n = len(sheets)
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            frames = list(ex.map(_read_sheet, [data] * n, [name] * n, sheets, [usecols] * n, [backend] * n))
+    return align_frames(frames)
+
+
+# ---------------- Multi-file / ZIP ingestion ----------------
+class NamedBytes(io.BytesIO):
+    """In-memory file with a name, shaped like Streamlit's UploadedFile."""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def _zip_members(zf: zipfile.ZipFile) -> list:
+    """Supported members of an archive, by path (hidden files and macOS metadata skipped)."""
+    members = []
+    for info in sorted(zf.infolist(), key=lambda i: i.filename):
+        base = os.path.basename(info.filename)
+        if info.is_dir() or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+            continue
+        if base.lower().endswith(SUPPORTED_EXTENSIONS):
+            members.append(info)
+    return members
+
+
+def list_uploads(files) -> List[Tuple[str, int]]:
+    """(name, size) of every file expand_uploads would return, read from the ZIP directories only."""
+    out = []
+    for f in files:
+        if f.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(f.getvalue())) as zf:
+                out.extend((os.path.basename(i.filename), i.file_size) for i in _zip_members(zf))
+        else:
+            out.append((f.name, getattr(f, "size", None) or len(f.getvalue())))
+    return out
+
+
+def expand_uploads(files) -> List[Tuple[str, bytes]]:
+    """(name, bytes) for every uploaded file, with ZIP archives expanded to their supported members."""
+    parts = []
+    for f in files:
+        if f.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(f.getvalue())) as zf:
+                parts.extend((os.path.basename(i.filename), zf.read(i)) for i in _zip_members(zf))
+        else:
+            parts.append((f.name, f.getvalue()))
+    return parts
+
+
+class MultiUpload:
+    """
+    Several uploads (or ZIP members) read as one dataset. Archives are only inflated
+    when `parts` is first read, i.e. when the dataset is not cached; its identity
+    (core.cache.upload_key) hashes the uploaded bytes as they are.
+    """
+
+    def __init__(self, files):
+        self.files = list(files)
+        listed = list_uploads(self.files)
+        self.names = [n for n, _ in listed]
+        if not self.names:
+            raise ValueError("No CSV / Excel / Parquet files found in the upload")
+        first = self.names[0]
+        self.name = first if len(self.names) == 1 else f"{first} + {len(self.names) - 1} more"
+        self.size = sum(size for _, size in listed)
+        self._parts: Optional[List[Tuple[str, bytes]]] = None
+
+    @property
+    def parts(self) -> List[Tuple[str, bytes]]:
+        if self._parts is None:
+            self._parts = expand_uploads(self.files)
+        return self._parts
+
+    def seek(self, pos: int) -> None:
+        pass
+
+
+def _read_part(name: str, data: bytes, kwargs: dict) -> pd.DataFrame:
+    return read_any(NamedBytes(data, name), **kwargs)
+
+
+def _missing_column(ref: pd.Series, n: int) -> pd.Series:
+    """All-missing column shaped like `ref` (integers widen to float to hold NaN)."""
+    dtype = ref.dtype
+    if (ptypes.is_integer_dtype(dtype) or ptypes.is_bool_dtype(dtype)) and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        dtype = "float64"
+    return pd.Series(index=range(n), dtype=dtype, name=ref.name)
+
+
+def align_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Union frames with differing columns (first-seen order); categoricals are unioned, not degraded to object."""
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = list(dict.fromkeys(c for f in frames for c in f.columns))
+    cols = {}
+    for c in columns:
+        ref = next(f[c] for f in frames if c in f.columns)
+        parts = [f[c].reset_index(drop=True) if c in f.columns else _missing_column(ref, len(f)) for f in frames]
+        cat = next((p for p in parts if isinstance(p.dtype, pd.CategoricalDtype)), None)
+        if cat is not None:
+            # a file / chunk where the column is entirely empty parses as float; keep the categorical
+            parts = [_missing_column(cat, len(p)) if not isinstance(p.dtype, pd.CategoricalDtype) and p.isna().all()
+                     else p for p in parts]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            cols[c] = pd.Series(union_categoricals([p.values for p in parts], sort_categories=True), name=c)
+        else:
+            cols[c] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(cols)
+
+
+def read_many(parts: List[Tuple[str, bytes]], max_workers: Optional[int] = None, **read_kwargs) -> pd.DataFrame:
+    """
+    Parse several (name, bytes) files concurrently on a process pool and union
+    them into one frame. Wall time is roughly that of the largest file.
+    """
+    if len(parts) == 1:
+        return _read_part(parts[0][0], parts[0][1], read_kwargs)
+    workers = min(len(parts), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        frames = [_read_part(n, b, read_kwargs) for n, b in parts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            frames = list(ex.map(_read_part, [n for n, _ in parts], [b for _, b in parts], [read_kwargs] * len(parts)))
+    return align_frames(frames)
+
+
+@timed("read_any")
+def read_any(
+    uploaded_file,
+    usecols: Optional[Iterable[str]] = None,
+    date_cols: Iterable[str] = (),
+    numeric_cols: Iterable[str] = (),
+    chunksize: Optional[int] = None,
+    dtype_backend: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    sheets: Optional[List] = None,
+) -> pd.DataFrame:
+    """
+    Read a file uploaded via Streamlit (UploadedFile), or a MultiUpload of
+    several files / ZIP archives parsed in parallel (`max_workers` processes).
+    Supports CSV, Excel (xls/xlsx; `sheets` picks worksheets), and Parquet.
+    For CSV, passing `usecols` or `chunksize` switches to the streaming reader;
+    .csv.gz / .csv.bz2 / .csv.zst uploads always use it.
+    dtype_backend="pyarrow" stores columns (notably strings) as Arrow arrays and
+    parses CSV with the multithreaded pyarrow engine; falls back to NumPy dtypes
+    when pyarrow is not installed.
+    """
+    if isinstance(uploaded_file, MultiUpload):
+        kwargs = {"usecols": usecols, "date_cols": tuple(date_cols), "numeric_cols": tuple(numeric_cols),
+                  "chunksize": chunksize, "dtype_backend": dtype_backend}
+        return read_many(uploaded_file.parts, max_workers=max_workers, **kwargs)
+
     name = uploaded_file.name.lower()
+    backend = _backend_kwargs(dtype_backend)
 
     try:
-        if name.endswith(".csv"):
+        if is_csv(name):
+            # Compressed CSVs always go through the chunked reader (streaming decompression)
+            if usecols is not None or chunksize or compression_of(name):
+                return read_csv_streaming(
+                    uploaded_file,
+                    usecols=usecols,
+                    date_cols=date_cols,
+                    numeric_cols=numeric_cols,
+                    chunksize=chunksize or DEFAULT_CHUNKSIZE,
+                    dtype_backend=dtype_backend,
+                )
             # Peek first 2KB to guess separator
-            sample = uploaded_file.read(2048)
-            uploaded_file.seek(0)
-            sep = infer_sep(sample)
+            sep = _peek_sep(uploaded_file)
+            if backend:
+                return pd.read_csv(uploaded_file, sep=sep, engine="pyarrow", **backend)
             df = pd.read_csv(uploaded_file, sep=sep)
             return df
 
         elif name.endswith(".xlsx") or name.endswith(".xls"):
-            return pd.read_excel(uploaded_file)
+            return read_excel_fast(uploaded_file, sheets=sheets, usecols=usecols,
+                                   dtype_backend=dtype_backend, max_workers=max_workers)
 
         elif name.endswith(".parquet"):
-            return pd.read_parquet(uploaded_file)
+            return pd.read_parquet(uploaded_file, **backend)
 
         else:
             raise ValueError(f"Unsupported file type: {name}")
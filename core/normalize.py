@@ -0,0 +1,113 @@
+"""
+core/normalize.py
+Post-load dtype compaction driven by the column mapping.
+Dimensions become categoricals, the amount is downcast and the date is parsed once,
+so every later groupby runs over compact columns instead of Python objects.
+"""
+
+from __future__ import annotations
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+
+DIMENSIONS = ("product", "channel", "customer_id")
+
+
+def _is_text(s: pd.Series) -> bool:
+    return ptypes.is_object_dtype(s.dtype) or ptypes.is_string_dtype(s.dtype)
+
+
+def _col_bytes(s: pd.Series) -> int:
+    return int(s.memory_usage(index=False, deep=True))
+
+
+def _compact_date(s: pd.Series) -> pd.Series:
+    if ptypes.is_datetime64_any_dtype(s.dtype) and not isinstance(s.dtype, pd.ArrowDtype):
+        return s
+    parsed = pd.to_datetime(s, errors="coerce")
+    if isinstance(parsed.dtype, pd.ArrowDtype):
+        parsed = parsed.astype("datetime64[ns]")
+    # Leave columns that are not really dates untouched
+    if parsed.notna().sum() == 0 and s.notna().any():
+        return s
+    return parsed
+
+
+def _compact_amount(s: pd.Series) -> pd.Series:
+    if isinstance(s.dtype, pd.ArrowDtype):
+        return s
+    if not ptypes.is_numeric_dtype(s.dtype) or ptypes.is_bool_dtype(s.dtype):
+        parsed = pd.to_numeric(s, errors="coerce")
+        if parsed.notna().sum() == 0 and s.notna().any():
+            return s
+        s = parsed
+    if ptypes.is_integer_dtype(s.dtype):
+        return pd.to_numeric(s, downcast="integer")
+    values = s.to_numpy(dtype="float64", na_value=np.nan)
+    finite = values[np.isfinite(values)]
+    if len(finite) == len(values) and np.array_equal(finite, np.round(finite)):
+        return pd.to_numeric(s, downcast="integer")
+    # float32 only when every value round-trips exactly
+    as32 = values.astype(np.float32)
+    if np.array_equal(as32.astype(np.float64), values, equal_nan=True):
+        return pd.Series(as32, index=s.index, name=s.name)
+    return s
+
+
+def _compact_dimension(s: pd.Series) -> pd.Series:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s
+    if ptypes.is_integer_dtype(s.dtype) and not isinstance(s.dtype, pd.ArrowDtype):
+        return pd.to_numeric(s, downcast="integer")
+    if _is_text(s):
+        return s.astype("category")
+    return s
+
+
+def compact_frame(df: pd.DataFrame, mapping) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Return (compacted_df, stats). Only mapped columns are touched and values are
+    preserved; running it again on an already compact frame is a cheap no-op.
+    Cumulative stats are kept in df.attrs["compaction"] for quick_profile.
+    """
+    plan = {}
+    if mapping.date and mapping.date in df.columns:
+        plan[mapping.date] = _compact_date
+    if mapping.amount and mapping.amount in df.columns:
+        plan[mapping.amount] = _compact_amount
+    for field in DIMENSIONS:
+        col = getattr(mapping, field, None)
+        if col and col in df.columns and col not in plan:
+            plan[col] = _compact_dimension
+
+    prev = dict(df.attrs.get("compaction") or {})
+    columns = dict(prev.get("columns") or {})
+    before = after = 0
+    out = df
+    for col, fn in plan.items():
+        s = df[col]
+        try:
+            new = fn(s)
+        except Exception:
+            continue
+        if new is s or new.dtype == s.dtype:
+            continue
+        b0, b1 = _col_bytes(s), _col_bytes(new)
+        before += b0
+        after += b1
+        columns[col] = {"from": str(s.dtype), "to": str(new.dtype), "bytes_before": b0, "bytes_after": b1}
+        if out is df:
+            out = df.copy(deep=False)
+        out[col] = new
+
+    stats = {
+        "columns": columns,
+        "bytes_before": int(prev.get("bytes_before", 0)) + before,
+        "bytes_after": int(prev.get("bytes_after", 0)) + after,
+    }
+    stats["saved_bytes"] = stats["bytes_before"] - stats["bytes_after"]
+    if out is not df:
+        out.attrs["compaction"] = stats
+    return out, stats
@@ -0,0 +1,149 @@
+"""
+core/perf.py
+Lightweight timing / peak-memory instrumentation for OmniInsights.
+Functions decorated with @timed record wall-clock seconds (and, when enabled,
+tracemalloc peak MB) into the collector of the current Streamlit run; the app
+shows them in a "Performance" panel and appends each run to a JSONL log.
+"""
+
+from __future__ import annotations
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+_CONFIG = {"enabled": True, "tracemalloc": False, "log": ".omni_cache/perf.jsonl"}
+_LOG_LOCK = threading.Lock()
+
+
+class Collector:
+    """Records of one app run (one Streamlit rerun)."""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._stack: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, rec: Dict) -> None:
+        with self._lock:
+            self.records.append(rec)
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self._t0
+
+
+_CURRENT: contextvars.ContextVar[Optional[Collector]] = contextvars.ContextVar("omni_perf", default=None)
+
+
+def configure(cfg: dict) -> None:
+    """Apply the `perf` config section (enabled, tracemalloc, log)."""
+    _CONFIG.update(cfg.get("perf", {}) or {})
+    if _CONFIG.get("enabled") and _CONFIG.get("tracemalloc"):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    elif tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def start_run(cfg: Optional[dict] = None) -> Optional[Collector]:
+    """Begin collecting for this run (replaces any unfinished collector)."""
+    if cfg is not None:
+        configure(cfg)
+    col = Collector() if _CONFIG.get("enabled") else None
+    _CURRENT.set(col)
+    return col
+
+
+def current() -> Optional[Collector]:
+    return _CURRENT.get()
+
+
+@contextmanager
+def measure(name: str, **meta):
+    """Time (and trace peak memory of) the enclosed block into the current collector."""
+    col = _CURRENT.get()
+    if col is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    frame = {"peak": 0}
+    if tracing:
+        base = tracemalloc.get_traced_memory()[0]
+        with col._lock:
+            # keep the enclosing block's peak before resetting the process-wide peak
+            if col._stack:
+                col._stack[-1]["peak"] = max(col._stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            col._stack.append(frame)
+        tracemalloc.reset_peak()
+    t = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        rec = {"name": name, "seconds": time.perf_counter() - t, **meta}
+        if tracing:
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            with col._lock:
+                if col._stack and col._stack[-1] is frame:
+                    col._stack.pop()
+                if col._stack:
+                    col._stack[-1]["peak"] = max(col._stack[-1]["peak"], peak)
+            rec["peak_mb"] = max(peak - base, 0) / 1e6
+        if error:
+            rec["error"] = error
+        col.add(rec)
+
+
+def timed(name: Optional[str] = None):
+    """Decorator form of measure()."""
+    def deco(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with measure(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def bind(fn):
+    """Run `fn` in a copy of the caller's context, so pool threads report to the same collector."""
+    ctx = contextvars.copy_context()
+    return lambda *a, **k: ctx.copy().run(fn, *a, **k)
+
+
+def finish_run(session: str = "", extra: Optional[Dict] = None) -> Optional[Dict]:
+    """Close the current run, append it to the JSONL log and return the summary."""
+    col = _CURRENT.get()
+    if col is None:
+        return None
+    _CURRENT.set(None)
+    summary = {
+        "ts": col.started,
+        "session": session,
+        "total_seconds": col.seconds,
+        "tracemalloc": tracemalloc.is_tracing(),
+        "records": list(col.records),
+        **(extra or {}),
+    }
+    path = _CONFIG.get("log")
+    if path:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with _LOG_LOCK, open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, default=str) + "\n")
+        except Exception as e:
+            print(f"[perf] Could not write perf log: {e}")
+    return summary
@@ -0,0 +1,281 @@
+"""
+core/prepared.py
+PreparedDataset: the mapped columns of one (data, mapping) pair, parsed once.
+Timestamps, amounts, calendar keys and factorized dimension codes are plain NumPy
+arrays, so insights, filters and the AI context never re-coerce or copy the frame.
+"""
+
+from __future__ import annotations
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.runs import checkpoint
+
+try:
+    import pyarrow as pa
+except Exception:
+    pa = None
+
+# Mapping fields that are factorized into integer codes (-1 = missing)
+CODED_FIELDS = ("order_id", "customer_id", "product", "channel")
+
+NS_PER_DAY = 86_400 * 10**9
+
+
+def _parse_ts(s: pd.Series) -> np.ndarray:
+    ts = pd.to_datetime(s, errors="coerce")
+    if ts.dtype == object:
+        # mixed UTC offsets (e.g. across a DST change) stay objects unless converted to UTC
+        ts = pd.to_datetime(s, errors="coerce", utc=True)
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        ts = ts.dt.tz_localize(None)
+    return np.asarray(ts, dtype="datetime64[ns]")
+
+
+def _parse_amount(s: pd.Series) -> np.ndarray:
+    return pd.to_numeric(s, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _factorize(s: pd.Series):
+    try:
+        codes, uniques = pd.factorize(s, sort=True)
+    except TypeError:  # mixed, unorderable labels
+        codes, uniques = pd.factorize(s, sort=False)
+    return codes.astype(np.int32, copy=False), pd.Index(uniques, name=s.name)
+
+
+@dataclass
+class PreparedDataset:
+    """Column arrays for one (data, mapping) pair; filtered views share the labels."""
+    mapping: object                     # core.semantics.ColumnMapping
+    source: pd.DataFrame                # frame the arrays were built from
+    rows: Optional[np.ndarray] = None   # positions into `source` (None = every row)
+    ts: Optional[np.ndarray] = None     # datetime64[ns], NaT where missing
+    amount: Optional[np.ndarray] = None # float64, NaN where missing / non-numeric
+    month: Optional[np.ndarray] = None  # int32 months since 1970-01
+    week: Optional[np.ndarray] = None   # int32 Monday-based weeks since epoch
+    day: Optional[np.ndarray] = None    # int32 days since 1970-01-01
+    codes: Dict[str, np.ndarray] = field(default_factory=dict)
+    uniques: Dict[str, pd.Index] = field(default_factory=dict)
+    # core.cube.RollupCube of exactly these rows (None = not known; take() only carries one it is given)
+    cube: Optional[Any] = field(default=None, repr=False)
+    # core.filter_index.FilterIndex over these rows (unfiltered datasets; take() never carries it)
+    index: Optional[Any] = field(default=None, repr=False)
+    # core.io.ParquetScan selecting exactly these rows from their file (Parquet loads; take() never carries it)
+    scan: Optional[Any] = field(default=None, repr=False)
+    _frame: Optional[pd.DataFrame] = field(default=None, repr=False)
+    # Shared intermediates of this view (see memo); never carried over by take()
+    _memo: Dict[Hashable, Any] = field(default_factory=dict, repr=False)
+    _memo_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _key_locks: Dict[Hashable, threading.Lock] = field(default_factory=dict, repr=False)
+
+    # ---------------- construction ----------------
+    @classmethod
+    def build(cls, df: pd.DataFrame, mapping) -> "PreparedDataset":
+        ds = cls(mapping=mapping, source=df)
+        if mapping.date and mapping.date in df.columns:
+            try:
+                ds.ts = _parse_ts(df[mapping.date])
+            except Exception as e:
+                # insights that need no date still run; date-based ones report the missing date
+                print(f"[prepared] Could not parse date column {mapping.date!r}: {e}")
+        if ds.ts is not None:
+            ok = ~np.isnat(ds.ts)
+            days = np.where(ok, ds.ts.astype("datetime64[D]").astype(np.int64), 0)
+            ds.day = days.astype(np.int32)
+            ds.week = ((days + 3) // 7).astype(np.int32)
+            ds.month = np.where(ok, ds.ts.astype("datetime64[M]").astype(np.int64), 0).astype(np.int32)
+        if mapping.amount and mapping.amount in df.columns:
+            ds.amount = _parse_amount(df[mapping.amount])
+        for f in CODED_FIELDS:
+            col = getattr(mapping, f, None)
+            if col and col in df.columns:
+                ds.codes[f], ds.uniques[f] = _factorize(df[col])
+        return ds
+
+    def take(self, idx: np.ndarray, cube=None) -> "PreparedDataset":
+        """Row subset (positions or boolean mask) sharing labels with this dataset.
+        `cube`: the rollup cube of the selected rows, when the caller has it."""
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        pick = (lambda a: None if a is None else a[idx])
+        return PreparedDataset(
+            mapping=self.mapping,
+            source=self.source,
+            rows=idx if self.rows is None else self.rows[idx],
+            ts=pick(self.ts),
+            amount=pick(self.amount),
+            month=pick(self.month),
+            week=pick(self.week),
+            day=pick(self.day),
+            codes={k: v[idx] for k, v in self.codes.items()},
+            uniques=self.uniques,
+            cube=cube,
+        )
+
+    # ---------------- shared intermediates ----------------
+    def memo(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """build() once per key for this view; concurrent callers wait for the first one.
+        Callers must treat the returned value as read-only. A cancelled build (core.runs)
+        stores nothing."""
+        if key in self._memo:
+            return self._memo[key]
+        with self._memo_lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._memo:
+                checkpoint()  # stage boundary: stop here if this run was superseded
+                self._memo[key] = build()
+            return self._memo[key]
+
+    def __getstate__(self):
+        # Locks cannot be pickled (process pools); computed intermediates travel along
+        state = dict(self.__dict__)
+        state.pop("_memo_lock", None)
+        state.pop("_key_locks", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memo_lock = threading.Lock()
+        self._key_locks = {}
+
+    # ---------------- accessors ----------------
+    def __len__(self) -> int:
+        return int(self.source.shape[0] if self.rows is None else len(self.rows))
+
+    @property
+    def shape(self):
+        return (len(self), int(self.source.shape[1]))
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.source.columns
+
+    @property
+    def dtypes(self) -> pd.Series:
+        return self.source.dtypes
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """Rows of the source frame in this view (materialized on first use)."""
+        if self._frame is None:
+            self._frame = self.source if self.rows is None else self.source.iloc[self.rows]
+        return self._frame
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.ts, self.amount, self.month, self.week, self.day, self.rows, *self.codes.values(), self.cube, self.index]
+        return int(sum(a.nbytes for a in arrays if a is not None))
+
+    def has(self, *fields: str) -> bool:
+        """True when every mapping field is mapped to an existing column."""
+        for f in fields:
+            if f == "date":
+                if self.ts is None:
+                    return False
+            elif f == "amount":
+                if self.amount is None:
+                    return False
+            elif f not in self.codes:
+                return False
+        return True
+
+    def col(self, f: str) -> Optional[str]:
+        """Source column name for a mapping field."""
+        return getattr(self.mapping, f, None)
+
+    def ts_ok(self) -> np.ndarray:
+        return ~np.isnat(self.ts)
+
+    def labels(self, f: str, codes: Iterable[int]) -> pd.Index:
+        return self.uniques[f].take(np.asarray(codes, dtype=np.intp))
+
+    def revenue_by(self, f: str) -> pd.Series:
+        """Sum of amount per observed value of a coded field, indexed by label (sorted).
+        Computed once per view and shared; do not modify the returned Series in place."""
+        return self.memo(("revenue_by", f), lambda: self._revenue_by(f))
+
+    def _revenue_by(self, f: str) -> pd.Series:
+        if self.cube is not None and f in self.cube.codes:
+            return self.cube.revenue_by(f)
+        c = self.codes[f]
+        ok = c >= 0
+        sums, counts = sum_by_key(c[ok], np.nan_to_num(self.amount[ok]), len(self.uniques[f]))
+        seen = np.flatnonzero(counts)
+        return pd.Series(sums[seen], index=self.labels(f, seen), name=self.col("amount"))
+
+    def total(self) -> float:
+        """Sum of amount (missing = 0), from the rollup cube when there is one."""
+        if self.cube is not None:
+            return self.cube.total()
+        return float(np.nansum(self.amount))
+
+    def arrow(self):
+        """
+        The mapped arrays as a pyarrow Table for SQL engines (columns ts as int64 ns,
+        month, amount and the coded fields); missing values (NaT, NaN, code -1) are NULL.
+        Value buffers are shared with the NumPy arrays, only validity bitmaps are new.
+        Built once per view.
+        """
+        return self.memo(("arrow",), self._arrow)
+
+    def _arrow(self):
+        cols = {}
+        if self.ts is not None:
+            bad = np.isnat(self.ts)
+            cols["ts"] = pa.array(self.ts.view(np.int64), mask=bad)
+            cols["month"] = pa.array(self.month, mask=bad)
+        if self.amount is not None:
+            cols["amount"] = pa.array(self.amount, from_pandas=True)
+        for f in CODED_FIELDS:
+            if f in self.codes:
+                cols[f] = pa.array(self.codes[f], mask=self.codes[f] < 0)
+        if not cols:
+            cols["_"] = pa.nulls(len(self))
+        return pa.table(cols)
+
+    def distinct(self, f: str) -> int:
+        """Number of distinct non-missing values of a coded field."""
+        c = self.codes[f]
+        c = c[c >= 0]
+        if not len(c):
+            return 0
+        return int(np.count_nonzero(np.bincount(c, minlength=len(self.uniques[f]))))
+
+
+def sum_by_key(keys: np.ndarray, values: np.ndarray, n: int):
+    """(sums, row counts) per integer key in [0, n). Sums use pandas' compensated
+    summation so totals match a DataFrame groupby to the last digit."""
+    counts = np.bincount(keys, minlength=n)
+    sums = np.zeros(n, dtype=np.float64)
+    if len(keys):
+        g = pd.Series(values, copy=False).groupby(keys, sort=False).sum()
+        sums[g.index.to_numpy()] = g.to_numpy()
+    return sums, counts
+
+
+def prepare(data, mapping) -> PreparedDataset:
+    """Accept a DataFrame or an existing PreparedDataset."""
+    if isinstance(data, PreparedDataset):
+        return data
+    return PreparedDataset.build(data, mapping)
+
+
+def month_start(keys: np.ndarray) -> pd.DatetimeIndex:
+    """Month keys -> first day of each month."""
+    return pd.DatetimeIndex(np.asarray(keys, dtype=np.int64).astype("datetime64[M]").astype("datetime64[ns]"))
+
+
+def month_label(keys: np.ndarray) -> list:
+    """Month keys -> "YYYY-MM" strings."""
+    return [str(m) for m in np.asarray(keys, dtype=np.int64).astype("datetime64[M]")]
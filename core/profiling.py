@@ -9,10 +9,15 @@ import pandas as pd
 def quick_profile(df: pd.DataFrame) -> dict:
     """
     Return a lightweight profile of the DataFrame as a dict.
-    Useful for display in Streamlit as JSON.
+    Useful for display in Streamlit as JSON. Computed once per frame and kept in
+    df.attrs["profile"] (the deep memory count alone takes seconds on millions of rows).
     """
     if df is None or df.empty:
         return {"rows": 0, "columns": 0, "message": "No data loaded"}
+    cached = df.attrs.get("profile")
+    # attrs are copied onto derived frames; only trust a profile made for this one
+    if cached and cached[0] == id(df):
+        return cached[1]
 
     profile = {
         "rows": int(df.shape[0]),
@@ -27,4 +32,15 @@ def quick_profile(df: pd.DataFrame) -> dict:
         if na_count > 0:
             profile["missing_values"][col] = na_count
 
+    profile["memory_mb"] = round(df.memory_usage(index=True, deep=True).sum() / 1e6, 2)
+    compaction = df.attrs.get("compaction")
+    if compaction and compaction.get("columns"):
+        profile["compaction"] = {
+            "saved_mb": round(compaction["saved_bytes"] / 1e6, 2),
+            "before_mb": round(compaction["bytes_before"] / 1e6, 2),
+            "after_mb": round(compaction["bytes_after"] / 1e6, 2),
+            "columns": {c: f"{v['from']} → {v['to']}" for c, v in compaction["columns"].items()},
+        }
+
+    df.attrs["profile"] = (id(df), profile)
     return profile
@@ -0,0 +1,85 @@
+"""
+core/runs.py
+Run tokens: every insight run is tagged with the filter state it was started for.
+Starting a run for a new state cancels the session's previous token; long computations
+call checkpoint() between stages and stop early once their token is stale.
+Cancellation is cooperative: work already inside a pandas / numpy call finishes that
+call, queued pool futures that have not started are dropped.
+"""
+
+from __future__ import annotations
+import contextvars
+import threading
+from typing import Dict, Hashable, List, Optional
+
+
+class Cancelled(BaseException):
+    """Raised at a checkpoint of a run superseded by a newer filter state.
+    A BaseException (like asyncio.CancelledError) so generic `except Exception`
+    error isolation never turns it into a cached {"error": ...} result."""
+
+
+class RunToken:
+    """Cancellation flag for one (scope, state) run plus the pool futures it queued."""
+
+    def __init__(self, scope: Hashable, state: Hashable):
+        self.scope = scope
+        self.state = state
+        self._event = threading.Event()
+        self._futures: List = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        self._event.set()
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for f in futures:
+            f.cancel()  # only futures that have not started yet; running ones stop at a checkpoint
+
+    def track(self, future) -> None:
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise Cancelled(f"run for {self.scope!r} superseded")
+
+
+_LATEST: Dict[Hashable, RunToken] = {}
+_LOCK = threading.Lock()
+_TOKEN: contextvars.ContextVar[Optional[RunToken]] = contextvars.ContextVar("omni_run", default=None)
+
+
+def start(scope: Hashable, state: Hashable) -> RunToken:
+    """
+    Token for `state` in `scope` (e.g. a Streamlit session), made current for this
+    context. The same state keeps its token (tab switches do not cancel background
+    work); a different state cancels the previous run.
+    """
+    with _LOCK:
+        prev = _LATEST.get(scope)
+        if prev is not None and prev.state == state and not prev.cancelled:
+            tok = prev
+        else:
+            if prev is not None:
+                prev.cancel()
+            tok = _LATEST[scope] = RunToken(scope, state)
+    _TOKEN.set(tok)
+    return tok
+
+
+def current() -> Optional[RunToken]:
+    return _TOKEN.get()
+
+
+def checkpoint() -> None:
+    """Raise Cancelled if the current run has been superseded (no-op outside a run)."""
+    tok = _TOKEN.get()
+    if tok is not None:
+        tok.check()
+
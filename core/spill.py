@@ -0,0 +1,119 @@
+"""
+core/spill.py
+Content-addressed Parquet copies of parsed uploads on local disk.
+Re-uploading the same CSV / Excel file (even after a server restart) loads the
+Parquet copy instead of re-parsing. Oldest-used files are evicted past a size budget.
+"""
+
+from __future__ import annotations
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (Parquet writer)
+except Exception:
+    pyarrow = None
+
+
+class ParquetSpill:
+    """Directory of `<id>.parquet` files bounded by `max_mb` (least recently used evicted first)."""
+
+    def __init__(self, directory: str, max_mb: float = 2048):
+        self.dir = Path(directory).expanduser()
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return pyarrow is not None and self.max_bytes > 0
+
+    def path_for(self, spill_id: str) -> Path:
+        return self.dir / f"{spill_id}.parquet"
+
+    def load(self, spill_id: str) -> Optional[pd.DataFrame]:
+        if not self.enabled:
+            return None
+        path = self.path_for(spill_id)
+        if not path.exists():
+            return None
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path)  # mark as recently used
+            return df
+        except Exception as e:
+            print(f"[spill] Dropping unreadable cache file {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+    def store(self, spill_id: str, df: pd.DataFrame) -> bool:
+        """Write df atomically; returns False if it cannot be represented as Parquet."""
+        if not self.enabled:
+            return False
+        path = self.path_for(spill_id)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            out = df if all(isinstance(c, str) for c in df.columns) else df.rename(columns=str)
+            out.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            print(f"[spill] Could not write Parquet copy: {e}")
+            return False
+        self.evict()
+        return True
+
+    def materialize(self, spill_id: str, data: bytes) -> Optional[Path]:
+        """Keep raw Parquet upload bytes on disk so they can be memory-mapped and scanned."""
+        if not self.enabled:
+            return None
+        path = self.path_for(spill_id)
+        if path.exists():
+            os.utime(path)
+            return path
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            print(f"[spill] Could not write upload to disk: {e}")
+            return None
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        with self._lock:
+            try:
+                files = [(p, p.stat()) for p in self.dir.glob("*.parquet")]
+            except FileNotFoundError:
+                return
+            total = sum(st.st_size for _, st in files)
+            for p, st in sorted(files, key=lambda f: f[1].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                if p == keep:
+                    continue
+                p.unlink(missing_ok=True)
+                total -= st.st_size
+
+
+_SPILL: Optional[ParquetSpill] = None
+
+
+def spill_cache(cfg: dict) -> ParquetSpill:
+    """Process-wide spill cache configured from the `cache` config section."""
+    global _SPILL
+    c = cfg.get("cache", {})
+    directory, max_mb = c.get("dir", ".omni_cache"), c.get("max_disk_mb", 2048)
+    if not c.get("spill", True):
+        max_mb = 0
+    if _SPILL is None or str(_SPILL.dir) != str(Path(directory).expanduser()) or _SPILL.max_bytes != int(float(max_mb) * 1024 * 1024):
+        _SPILL = ParquetSpill(directory, max_mb)
+    return _SPILL
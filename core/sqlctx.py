@@ -1,28 +1,135 @@
 """
 core/sqlctx.py
 Tiny SQL-like aggregator for compact context. Prefer duckdb if installed.
+DuckDB connections are kept per dataset (see DuckConnections), with each filtered
+view registered once as an Arrow table, so a query costs only the query.
 """
 
 from __future__ import annotations
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import Optional, Tuple
+import numpy as np
 import pandas as pd
 
+from core.cube import UNDATED
+from core.fingerprint import rows_fingerprint
+from core.perf import timed
+from core.prepared import PreparedDataset, prepare, month_label
+
 try:
     import duckdb  # type: ignore
+    import pyarrow  # noqa: F401  (PreparedDataset.arrow)
 except Exception:
     duckdb = None
 
 
-def _mk_view(df: pd.DataFrame, mapping) -> pd.DataFrame:
-    d = df.copy()
-    if mapping.date and mapping.date in d.columns:
-        d[mapping.date] = pd.to_datetime(d[mapping.date], errors="coerce")
-        d["month"] = d[mapping.date].dt.to_period("M").astype(str)
-        d["date"]  = d[mapping.date].dt.date
-    amt = mapping.amount
-    if amt and amt in d.columns:
-        d["_amount"] = pd.to_numeric(d[amt], errors="coerce").fillna(0.0)
-    return d
+class DuckConnections:
+    """
+    One DuckDB connection per dataset (source frame + mapping), least recently used
+    closed past `max_datasets`. Inside it every filtered view gets its own cursor with
+    the view's Arrow table registered as `t` once, so repeated queries reuse both the
+    registration and the statement text; views past `max_views` are closed.
+    """
+
+    def __init__(self, max_datasets: int = 4, max_views: int = 8):
+        self.max_datasets = max_datasets
+        self.max_views = max_views
+        self.config: dict = {}
+        self._conns: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (connection, views, source ref)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def configure(self, **config) -> None:
+        """DuckDB settings (threads, memory_limit, temp_directory); open connections are closed on change."""
+        config = {k: str(v) for k, v in config.items() if v}
+        if config != self.config:
+            self.config = config
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._conns = list(self._conns.values()), OrderedDict()
+        for con, views, _ in conns:
+            _close(con, views)
+
+    def _view(self, ds: PreparedDataset):
+        if os.getpid() != self._pid:
+            # forked worker: the parent's connections are not ours to use
+            self._conns, self._lock, self._pid = OrderedDict(), threading.Lock(), os.getpid()
+        # the source frame's identity (checked through a weakref, ids get reused) + mapping
+        key = (id(ds.source), tuple(sorted(ds.mapping.to_dict().items())))
+        vkey = ds.memo(("sql", "rows"), lambda: rows_fingerprint(ds.rows, len(ds.source)))
+        with self._lock:
+            entry = self._conns.get(key)
+            if entry is not None and entry[2]() is not ds.source:
+                _close(*self._conns.pop(key)[:2])
+                entry = None
+            if entry is None:
+                self._conns[key] = (duckdb.connect(database=":memory:", config=self.config), OrderedDict(),
+                                    weakref.ref(ds.source))
+            self._conns.move_to_end(key)
+            while len(self._conns) > self.max_datasets:
+                _close(*self._conns.popitem(last=False)[1][:2])
+            con, views, _ = self._conns[key]
+            if vkey not in views:
+                cur = con.cursor()
+                cur.register("t", ds.arrow())
+                views[vkey] = (cur, threading.Lock())
+            views.move_to_end(vkey)
+            while len(views) > self.max_views:
+                _close_view(*views.popitem(last=False)[1])
+            return views[vkey]
+
+    @contextmanager
+    def cursor(self, ds: PreparedDataset):
+        """Cursor whose table `t` is this view's rows (one query at a time per view)."""
+        cur, lock = self._view(ds)
+        with lock:
+            yield cur
+
+
+def _close_view(cur, lock) -> None:
+    with lock:  # let a running query finish first
+        cur.close()
+
+
+def _close(con, views) -> None:
+    for cur, lock in views.values():
+        _close_view(cur, lock)
+    con.close()
+
+
+_CONNECTIONS = DuckConnections()
+
+
+def connections() -> DuckConnections:
+    """Process-wide DuckDB connection manager."""
+    return _CONNECTIONS
+
+
+RECENT_MONTHS_SQL = """
+  WITH m AS (
+    SELECT month, SUM(COALESCE(amount, 0)) AS revenue
+    FROM t
+    WHERE month IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1
+  )
+  SELECT month, revenue
+  FROM m
+  ORDER BY month DESC
+  LIMIT 6
+"""
+
+
+def _top_by(ds, f: str, n: int = 10) -> pd.DataFrame:
+    """Top `n` labels of `f` by revenue in a PreparedDataset or RollupCube."""
+    g = ds.revenue_by(f).rename("revenue").reset_index()
+    return g.sort_values("revenue", ascending=False).head(n)
 
 
 def _markdown_table(df: pd.DataFrame, max_rows: int = 10) -> str:
@@ -36,43 +143,36 @@ def _markdown_table(df: pd.DataFrame, max_rows: int = 10) -> str:
     return "\n".join(lines)
 
 
-def reasons_pack(df: pd.DataFrame, mapping, recent_months: int = 3) -> str:
+@timed("reasons_pack")
+def reasons_pack(data, mapping, recent_months: int = 3) -> str:
     """
     Build a tiny SQL-style pack: last-month vs prev-month, and top movers.
     Keeps strict bounds on size.
     """
-    if df is None or df.empty or not mapping.amount:
+    if data is None or data.empty or not mapping.amount:
+        return "### SQL Pack\n- n/a"
+    ds = prepare(data, mapping)
+    if not ds.has("amount"):
         return "### SQL Pack\n- n/a"
-
-    d = _mk_view(df, mapping)
-    amt = "_amount"
-    prod = mapping.product if mapping.product in d.columns else None
-    ch   = mapping.channel if mapping.channel in d.columns else None
 
     # Prefer duckdb for speed; otherwise pandas
     md_sections = ["### SQL Pack"]
+    has_month = ds.has("date") and ds.ts_ok().any()
 
     # 1) Month vs previous month totals
     try:
-        if duckdb:
-            con = duckdb.connect(database=":memory:")
-            con.register("t", d)
-            q = """
-              WITH m AS (
-                SELECT month, SUM({amt}) AS revenue
-                FROM t
-                WHERE month IS NOT NULL
-                GROUP BY 1
-                ORDER BY 1
-              )
-              SELECT month, revenue
-              FROM m
-              ORDER BY month DESC
-              LIMIT 6
-            """.format(amt=amt)
-            mv = con.execute(q).df().sort_values("month")
+        if not has_month:
+            raise ValueError("no dated rows")
+        if ds.cube is not None:
+            mv = ds.cube.monthly()[["month", "revenue"]].tail(6)
+        elif duckdb:
+            with connections().cursor(ds) as cur:
+                mv = cur.execute(RECENT_MONTHS_SQL).df().sort_values("month")
         else:
-            mv = d.groupby("month", as_index=False)[amt].sum().rename(columns={amt: "revenue"}).sort_values("month").tail(6)
+            ok = ds.ts_ok()
+            mv = (pd.DataFrame({"month": ds.month[ok], "revenue": np.nan_to_num(ds.amount[ok])})
+                  .groupby("month", as_index=False)["revenue"].sum().sort_values("month").tail(6))
+        mv["month"] = month_label(mv["month"].to_numpy())
         md_sections.append("**Recent Months (Revenue)**")
         md_sections.append(_markdown_table(mv))
     except Exception:
@@ -80,17 +180,20 @@ def reasons_pack(df: pd.DataFrame, mapping, recent_months: int = 3) -> str:
 
     # 2) Last-month breakdown by product / channel
     try:
-        if "month" in d.columns and d["month"].notna().any():
-            last_m = d["month"].dropna().iloc[-1]
-            dd = d[d["month"] == last_m]
-            if prod:
-                g = dd.groupby(prod, as_index=False)[amt].sum().rename(columns={amt: "revenue"}).sort_values("revenue", ascending=False).head(10)
+        if has_month:
+            # month of the last dated row
+            last_key = ds.month[np.flatnonzero(ds.ts_ok())[-1]]
+            last_m = month_label([last_key])[0]
+            if ds.cube is not None:
+                dd = ds.cube.take((ds.cube.day != UNDATED) & (ds.cube.month == last_key))
+            else:
+                dd = ds.take(ds.ts_ok() & (ds.month == last_key))
+            if ds.has("product"):
                 md_sections.append(f"**{last_m} Top Products**")
-                md_sections.append(_markdown_table(g))
-            if ch:
-                g2 = dd.groupby(ch, as_index=False)[amt].sum().rename(columns={amt: "revenue"}).sort_values("revenue", ascending=False).head(10)
+                md_sections.append(_markdown_table(_top_by(dd, "product")))
+            if ds.has("channel"):
                 md_sections.append(f"**{last_m} Top Channels**")
-                md_sections.append(_markdown_table(g2))
+                md_sections.append(_markdown_table(_top_by(dd, "channel")))
     except Exception:
         pass
 
@@ -1,15 +1,33 @@
+import numpy as np
 import pandas as pd
 
-def monthly_retention_cohort(df: pd.DataFrame, mapping) -> dict:
-    date, cid = mapping.date, mapping.customer_id
-    if not date or not cid or date not in df or cid not in df:
+from core.prepared import PreparedDataset, month_start
+from core.runs import checkpoint
+from . import engine
+
+
+def cohort_counts(ds: PreparedDataset) -> pd.DataFrame:
+    """Customers per (first-purchase month, order month) as month keys."""
+    cust = ds.codes["customer_id"]
+    ok = ds.ts_ok() & (cust >= 0)
+    c, m = cust[ok].astype(np.int64), ds.month[ok].astype(np.int64)
+    # distinct (customer, month) pairs, then each customer's first month
+    lo = int(m.min()) if len(m) else 0
+    span = int(m.max()) - lo + 1 if len(m) else 1
+    pairs = np.unique(c * span + (m - lo))
+    checkpoint()
+    pc, pm = pairs // span, pairs % span
+    first = pd.Series(pm).groupby(pc).transform("min").to_numpy()
+    checkpoint()
+    return pd.DataFrame({"cohort": first + lo, "order_month": pm + lo}).value_counts().rename("n").reset_index()
+
+
+def monthly_retention_cohort(ds: PreparedDataset, mapping) -> dict:
+    if not ds.has("date", "customer_id"):
         return {"error": "Need date and customer_id"}
-    tmp = df[[date, cid]].dropna()
-    tmp[date] = pd.to_datetime(tmp[date], errors="coerce")
-    tmp = tmp.dropna(subset=[date])
-    tmp['order_month'] = tmp[date].values.astype('datetime64[M]')
-    first = tmp.groupby(cid)['order_month'].min().rename('cohort')
-    tmp = tmp.join(first, on=cid)
-    pivot = tmp.pivot_table(index='cohort', columns='order_month', values=cid, aggfunc='nunique')
+    counts = (engine.kernel("cohort_counts") or cohort_counts)(ds)
+    pivot = counts.pivot(index="cohort", columns="order_month", values="n").sort_index().sort_index(axis=1).astype(float)
+    pivot.index = month_start(pivot.index.to_numpy()).rename("cohort")
+    pivot.columns = month_start(pivot.columns.to_numpy()).rename("order_month")
     retention = pivot.divide(pivot.iloc[:,0], axis=0).fillna(0.0)
     return {"retention": retention.reset_index()}
@@ -0,0 +1,74 @@
+"""
+insights/degrade.py
+Cheaper stand-ins for insights that overrun their time budget (limits.insight_budget_s).
+Each returns the insight's usual result computed on a reduced input, plus a short
+note describing the approximation (None when nothing was dropped).
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from core.prepared import PreparedDataset
+from . import cohorts, customers, rfm
+
+DEFAULTS = {"sample_customers": 50_000, "last_cohorts": 12}
+
+
+def sample_customers(ds: PreparedDataset, max_customers: int):
+    """Every k-th customer (all of their rows), so per-customer aggregates stay exact."""
+    n = len(ds.uniques["customer_id"])
+    if n <= max_customers:
+        return ds, 1.0
+    step = math.ceil(n / max_customers)
+    c = ds.codes["customer_id"]
+    return ds.take((c >= 0) & (c % step == 0)), 1.0 / step
+
+
+def last_cohorts(ds: PreparedDataset, n: int) -> PreparedDataset:
+    """All rows of the customers in the `n` most recent first-purchase-month cohorts."""
+    c = ds.codes["customer_id"]
+    ok = ds.ts_ok() & (c >= 0)
+    if not ok.any():
+        return ds
+    first = pd.Series(ds.month[ok]).groupby(c[ok]).min()
+    months = np.unique(first.to_numpy())
+    if len(months) <= n:
+        return ds
+    cutoff = months[-n]
+    recent = np.zeros(len(ds.uniques["customer_id"]), dtype=bool)
+    recent[first.index[first.to_numpy() >= cutoff]] = True
+    return ds.take(ok & recent[np.where(ok, c, 0)])
+
+
+def _cohorts(ds, mapping, opts):
+    n = int(opts["last_cohorts"])
+    sub = last_cohorts(ds, n)
+    return cohorts.monthly_retention_cohort(sub, mapping), (f"last {n} monthly cohorts only" if sub is not ds else None)
+
+
+def _rfm(ds, mapping, opts):
+    sub, frac = sample_customers(ds, int(opts["sample_customers"]))
+    return rfm.rfm_segments(sub, mapping), (f"{frac:.0%} sample of customers" if frac < 1 else None)
+
+
+def _repeat_rate(ds, mapping, opts):
+    sub, frac = sample_customers(ds, int(opts["sample_customers"]))
+    return customers.repeat_rate(sub, mapping), (f"{frac:.0%} sample of customers" if frac < 1 else None)
+
+
+DEGRADED = {
+    "cohorts": _cohorts,
+    "rfm": _rfm,
+    "repeat_rate": _repeat_rate,
+}
+
+
+def degraded(qid: str, ds: PreparedDataset, mapping, opts=None) -> dict:
+    """Approximate result for `qid` flagged with {"degraded": note} (unflagged when the
+    reduced input turned out to be the whole input)."""
+    res, note = DEGRADED[qid](ds, mapping, {**DEFAULTS, **(opts or {})})
+    if note and isinstance(res, dict) and "error" not in res:
+        res = {**res, "degraded": note}
+    return res
@@ -0,0 +1,110 @@
+"""
+insights/engine.py
+Which engine runs the full-data passes behind the insights (compute.engine).
+"pandas" uses the NumPy / pandas kernels in the insight modules; "duckdb"
+(insights.sqlengine) and "polars" (insights.polarsengine) replace the shared nodes,
+the KPI aggregates and the cohort counts with the same results computed their way.
+An engine whose library is missing falls back to pandas (missing() names it so the
+app can say so).
+"""
+
+from __future__ import annotations
+import contextvars
+import math
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import polarsengine, sqlengine
+
+ENGINES = ("pandas", "duckdb", "polars")
+
+# engine -> kernels by name (None when its library is not installed)
+KERNELS: Dict[str, Optional[Dict[str, Callable]]] = {
+    "pandas": {},
+    "duckdb": sqlengine.KERNELS if sqlengine.duckdb is not None else None,
+    "polars": polarsengine.KERNELS if polarsengine.pl is not None else None,
+}
+
+# Engines whose library keeps its own thread pool: once it has started, worker
+# processes forked from this one (insights.service) can hang on it
+FORK_UNSAFE = ("polars",)
+
+_CONFIG = {"engine": "pandas"}
+_ENGINE: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("omni_engine", default=None)
+
+
+def configure(cfg: dict) -> None:
+    """Apply compute.engine (and the DuckDB connection settings)."""
+    engine = (cfg.get("compute", {}) or {}).get("engine", "pandas") or "pandas"
+    if engine not in ENGINES:
+        print(f"[engine] Unknown engine {engine!r}; using pandas")
+        engine = "pandas"
+    _CONFIG["engine"] = engine
+    sqlengine.configure(cfg)
+
+
+def current() -> str:
+    """Engine in effect for this context."""
+    engine = _ENGINE.get() or _CONFIG["engine"]
+    return engine if KERNELS.get(engine) is not None else "pandas"
+
+
+def missing() -> Optional[str]:
+    """The configured engine when its library is not installed (pandas runs instead)."""
+    engine = _CONFIG["engine"]
+    return engine if KERNELS.get(engine) is None else None
+
+
+@contextmanager
+def use(engine: str):
+    """Run the enclosed insights on `engine` regardless of the configured one."""
+    tok = _ENGINE.set(engine)
+    try:
+        yield
+    finally:
+        _ENGINE.reset(tok)
+
+
+def fork_safe() -> bool:
+    """False when the active engine cannot run on forked service workers."""
+    return current() not in FORK_UNSAFE
+
+
+def kernel(name: str) -> Optional[Callable]:
+    """The active engine's implementation of a named pass, or None for the pandas one."""
+    return KERNELS[current()].get(name)
+
+
+# ---------------- parity ----------------
+def _same(a, b, rtol: float) -> bool:
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k], rtol) for k in a)
+    if isinstance(a, pd.DataFrame) and isinstance(b, pd.DataFrame):
+        try:
+            pd.testing.assert_frame_equal(a, b, check_exact=False, rtol=rtol)
+            return True
+        except AssertionError:
+            return False
+    if isinstance(a, float) and isinstance(b, float):
+        return (math.isnan(a) and math.isnan(b)) or math.isclose(a, b, rel_tol=rtol)
+    return type(a) is type(b) and a == b
+
+
+def parity(data, mapping, engine: str = "duckdb", rtol: float = 1e-9) -> Dict[str, bool]:
+    """
+    Run every insight on pandas and on `engine` and report, per insight, whether the
+    results agree (floats to `rtol`: engines add in different orders).
+    """
+    from core.prepared import prepare
+    from .registry import run_all
+
+    ds = prepare(data, mapping)
+    everything = np.ones(len(ds), dtype=bool)  # fresh views, so no node is shared between engines
+    with use("pandas"):
+        ref = run_all(ds.take(everything), mapping, executor="serial")
+    with use(engine):
+        got = run_all(ds.take(everything), mapping, executor="serial")
+    return {qid: _same(ref[qid], got[qid], rtol) for qid in ref}
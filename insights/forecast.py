@@ -1,14 +1,13 @@
 import pandas as pd
 
-def naive_forecast(df: pd.DataFrame, mapping) -> dict:
-    date, amt = mapping.date, mapping.amount
-    if not date or not amt or date not in df or amt not in df:
+from core.prepared import PreparedDataset
+from .nodes import node
+
+
+def naive_forecast(ds: PreparedDataset, mapping) -> dict:
+    if not ds.has("date", "amount"):
         return {"error": "Need date and amount"}
-    tmp = df[[date, amt]].dropna()
-    tmp[date] = pd.to_datetime(tmp[date], errors="coerce")
-    tmp = tmp.dropna(subset=[date])
-    g = tmp.groupby(pd.Grouper(key=date, freq="M"))[amt].sum().reset_index()
-    g.columns = ["month", "revenue"]
+    g = node(ds, "monthly_revenue").copy()
     # simple 3-month moving average forecast for next 3 months
     g['ma3'] = g['revenue'].rolling(3).mean()
     if len(g) >= 3:
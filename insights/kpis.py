@@ -1,11 +1,23 @@
-import pandas as pd
+import numpy as np
 
-def compute_kpis(df: pd.DataFrame, mapping) -> dict:
-    date, amt, oid, cid = mapping.date, mapping.amount, mapping.order_id, mapping.customer_id
-    total_sales = float(df[amt].sum()) if amt and amt in df else None
-    num_orders = int(df[oid].nunique()) if oid and oid in df else len(df)
-    num_customers = int(df[cid].nunique()) if cid and cid in df else None
+from core.prepared import PreparedDataset, sum_by_key
+from core.runs import checkpoint
+from . import engine
+
+
+def compute_kpis(ds: PreparedDataset, mapping) -> dict:
+    fast = engine.kernel("kpis")
+    if fast is not None:
+        return {"kpis": fast(ds)}
+    total_sales = ds.total() if ds.has("amount") else None
+    num_orders = ds.distinct("order_id") if ds.has("order_id") else len(ds)
+    num_customers = ds.distinct("customer_id") if ds.has("customer_id") else None
     aov = None
-    if amt and oid and amt in df and oid in df:
-        aov = float(df.groupby(oid)[amt].sum().mean())
+    checkpoint()
+    if ds.has("amount", "order_id"):
+        c = ds.codes["order_id"]
+        ok = c >= 0
+        per_order, counts = sum_by_key(c[ok], np.nan_to_num(ds.amount[ok]), len(ds.uniques["order_id"]))
+        seen = counts > 0
+        aov = float(per_order[seen].mean()) if seen.any() else float("nan")
     return {"kpis": {"total_sales": total_sales, "num_orders": num_orders, "num_customers": num_customers, "avg_order_value": aov}}
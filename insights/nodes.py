@@ -0,0 +1,115 @@
+"""
+insights/nodes.py
+Named intermediates shared by several insights. Each node is a full pass over the
+data, computed at most once per PreparedDataset view (PreparedDataset.memo) and
+reused by every insight that depends on it. Node values are read-only.
+With compute.engine "duckdb" / "polars" the same nodes come from that engine (insights.engine).
+Views carrying a rollup cube (core.cube) read the additive nodes from its cells instead.
+"""
+
+import numpy as np
+import pandas as pd
+
+from core.prepared import PreparedDataset, month_start, sum_by_key
+from core.runs import checkpoint
+from . import engine
+
+
+def monthly_revenue(ds: PreparedDataset) -> pd.DataFrame:
+    """Revenue per calendar month (month-end labels, empty months = 0)."""
+    if ds.cube is not None:
+        g = ds.cube.monthly()
+        g = g[g["priced"] > 0]
+        if g.empty:
+            return monthly_frame(0, np.array([], dtype=float))
+        m = g["month"].to_numpy()
+        lo = int(m.min())
+        sums = np.zeros(int(m.max()) - lo + 1)
+        sums[m - lo] = g["revenue"].to_numpy()
+        return monthly_frame(lo, sums)
+    ok = ds.ts_ok() & ~np.isnan(ds.amount)
+    m, a = ds.month[ok], ds.amount[ok]
+    if not len(m):
+        return monthly_frame(0, np.array([], dtype=float))
+    lo = int(m.min())
+    sums, _ = sum_by_key(m - lo, a, int(m.max()) - lo + 1)
+    return monthly_frame(lo, sums)
+
+
+def monthly_frame(lo: int, sums: np.ndarray) -> pd.DataFrame:
+    """monthly_revenue's frame for consecutive months starting at month key `lo`."""
+    if not len(sums):
+        return pd.DataFrame({"month": pd.DatetimeIndex([]), "revenue": np.array([], dtype=float)})
+    months = month_start(np.arange(lo, lo + len(sums))) + pd.offsets.MonthEnd(0)
+    return pd.DataFrame({"month": months, "revenue": sums})
+
+
+def per_product_revenue(ds: PreparedDataset) -> pd.Series:
+    """Revenue per product label (sorted by label)."""
+    return ds.revenue_by("product")
+
+
+def orders_per_customer(ds: PreparedDataset) -> pd.Series:
+    """Distinct orders (or rows, without an order id) per observed customer."""
+    cust = ds.codes["customer_id"]
+    n_c = len(ds.uniques["customer_id"])
+    has_c = cust >= 0
+    seen = np.flatnonzero(np.bincount(cust[has_c], minlength=n_c))
+    if ds.has("order_id"):
+        oid = ds.codes["order_id"]
+        ok = has_c & (oid >= 0)
+        pairs = np.unique(cust[ok].astype(np.int64) * len(ds.uniques["order_id"]) + oid[ok])
+        checkpoint()
+        counts = np.bincount(pairs // len(ds.uniques["order_id"]), minlength=n_c)
+    else:
+        counts = np.bincount(cust[has_c], minlength=n_c)
+    return pd.Series(counts[seen], index=ds.labels("customer_id", seen))
+
+
+def per_customer_aggregates(ds: PreparedDataset) -> pd.DataFrame:
+    """Last order time, order rows and revenue per customer (rows with date, customer and amount)."""
+    cust = ds.codes["customer_id"]
+    ok = ds.ts_ok() & (cust >= 0) & ~np.isnan(ds.amount)
+    g = pd.DataFrame({"c": cust[ok], "t": ds.ts[ok].astype(np.int64), "a": ds.amount[ok]}).groupby("c", sort=True)
+    checkpoint()
+    out = pd.DataFrame({"last": g["t"].max(), "rows": g.size(), "revenue": g["a"].sum()})
+    out.index = ds.labels("customer_id", out.index)
+    return out
+
+
+NODES = {
+    "monthly_revenue": monthly_revenue,
+    "per_product_revenue": per_product_revenue,
+    "orders_per_customer": orders_per_customer,
+    "per_customer_aggregates": per_customer_aggregates,
+}
+# Nodes a rollup cube answers from its cells, whatever the engine
+CUBED = ("monthly_revenue", "per_product_revenue")
+
+
+def _engine_kernel(ds: PreparedDataset, name: str):
+    if ds.cube is not None and name in CUBED:
+        return None
+    return engine.kernel(name)
+
+
+def build_together(ds: PreparedDataset, names) -> list:
+    """
+    Compute several nodes in one go when the engine can share their scan (polars);
+    returns the nodes it built ([] when the engine builds them one by one).
+    """
+    batch = engine.kernel("nodes")
+    key = engine.current()
+    todo = [n for n in dict.fromkeys(names) if ("node", n, key) not in ds._memo and _engine_kernel(ds, n)]
+    if batch is None or len(todo) < 2:
+        return []
+    built = batch(ds, todo)
+    for n, value in built.items():
+        ds.memo(("node", n, key), lambda value=value: value)
+    return list(built)
+
+
+def node(ds: PreparedDataset, name: str):
+    """Value of a named node for this dataset view (computed on first use by the active engine)."""
+    build = _engine_kernel(ds, name) or NODES[name]
+    return ds.memo(("node", name, engine.current()), lambda: build(ds))
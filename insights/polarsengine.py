@@ -0,0 +1,233 @@
+"""
+insights/polarsengine.py
+Polars engine for the full-data passes behind the insights (compute.engine: polars).
+Each pass is a LazyFrame plan over the view's rows. Views loaded from a Parquet
+file (PreparedDataset.scan) are re-read with pl.scan_parquet: only the mapped
+columns, with the load window and the sidebar date / label filters pushed into the
+scan. Other views use the PreparedDataset's Arrow view (pl.from_arrow shares its
+buffers). Polars prunes the columns each plan reads and runs the group-bys
+multithreaded. Nodes requested together are collected in one pl.collect_all, so
+their common scan / filter work is optimised once.
+"""
+
+from __future__ import annotations
+from typing import Callable, Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+from core.prepared import CODED_FIELDS, PreparedDataset
+from core.runs import checkpoint
+
+try:
+    import polars as pl
+    import pyarrow  # noqa: F401  (PreparedDataset.arrow)
+except Exception:
+    pl = None
+
+
+def _frame(ds: PreparedDataset):
+    """This view's rows as a LazyFrame with the columns of PreparedDataset.arrow (built once)."""
+    def build():
+        lf = _scan(ds) if ds.scan is not None else None
+        return lf if lf is not None else pl.from_arrow(ds.arrow()).lazy()
+    return ds.memo(("polars",), build)
+
+
+def _label_type(dtype) -> bool:
+    return dtype == pl.String or dtype == pl.Categorical or dtype.is_integer()
+
+
+def _scan(ds: PreparedDataset):
+    """
+    ds.scan as a pl.scan_parquet plan computing the same columns as ds.arrow(), or None
+    when a mapped column is not typed the way this can match (e.g. dates stored as
+    text, which only pandas' parser reads the same way).
+    """
+    scan = ds.scan
+    lf = pl.scan_parquet(scan.path)
+    try:
+        schema = lf.collect_schema()
+    except Exception as e:
+        print(f"[polars] Cannot scan {scan.path}: {e}")
+        return None
+    cols = {f: ds.col(f) for f in ("date", "amount", *CODED_FIELDS) if ds.has(f)}
+    if not cols or any(c not in schema for c in cols.values()):
+        return None
+    if ((scan.window or scan.date_range) and "date" not in cols) or any(f not in cols for f in scan.labels):
+        return None
+
+    out, where = [], []
+    if "date" in cols:
+        dtype = schema[cols["date"]]
+        if not (isinstance(dtype, pl.Datetime) or dtype == pl.Date):
+            return None
+        ts = pl.col(cols["date"])
+        if isinstance(dtype, pl.Datetime) and dtype.time_zone:
+            ts = ts.dt.replace_time_zone(None)  # wall time, as core.prepared._parse_ts
+        ts = ts.cast(pl.Datetime("ns"))
+        out += [ts.cast(pl.Int64).alias("ts"),
+                ((ts.dt.year() - 1970) * 12 + ts.dt.month() - 1).cast(pl.Int32).alias("month")]
+        if scan.window:  # as core.io.read_parquet_window: whole days
+            start = pd.Timestamp(scan.window[0]).normalize()
+            stop = pd.Timestamp(scan.window[1]).normalize() + pd.Timedelta(days=1)
+            where.append((ts >= start) & (ts < stop))
+        if scan.date_range:  # as core.filters._in_dates
+            where.append(ts.is_between(pd.to_datetime(scan.date_range[0]), pd.to_datetime(scan.date_range[1])))
+    if "amount" in cols:
+        if not schema[cols["amount"]].is_numeric():
+            return None
+        out.append(pl.col(cols["amount"]).cast(pl.Float64).fill_nan(None).alias("amount"))
+    for f in CODED_FIELDS:
+        if f in cols:
+            if not _label_type(schema[cols[f]]):
+                return None
+            labels = ds.uniques[f]
+            # the dataset's own codes, so the finishers map them back with ds.labels
+            out.append(pl.col(cols[f]).replace_strict(labels.tolist(), list(range(len(labels))), default=None,
+                                                      return_dtype=pl.Int32).alias(f))
+    for f, values in scan.labels.items():
+        where.append(pl.col(cols[f]).is_in(values))
+    lf = (lf.filter(*where) if where else lf).select(out)
+    try:
+        lf.clear().collect()  # type mismatches (e.g. labels vs. column) surface here, not mid-insight
+    except Exception as e:
+        print(f"[polars] Falling back to the in-memory rows for {scan.path}: {e}")
+        return None
+    return lf
+
+
+def _np(s, dtype) -> np.ndarray:
+    return s.to_numpy().astype(dtype, copy=False)
+
+
+# ---------------- plans + finishers (same shapes as insights.nodes / kpis / cohorts) ----------------
+def _monthly_revenue_plan(ds):
+    return (_frame(ds).filter(pl.col("month").is_not_null() & pl.col("amount").is_not_null())
+            .group_by("month").agg(pl.col("amount").sum().alias("revenue")))
+
+
+def _monthly_revenue(ds, g) -> pd.DataFrame:
+    from .nodes import monthly_frame
+
+    if not g.height:
+        return monthly_frame(0, np.array([], dtype=float))
+    m = _np(g["month"], np.int64)
+    lo = int(m.min())
+    sums = np.zeros(int(m.max()) - lo + 1)
+    sums[m - lo] = _np(g["revenue"], np.float64)
+    return monthly_frame(lo, sums)
+
+
+def _per_product_revenue_plan(ds):
+    return (_frame(ds).filter(pl.col("product").is_not_null())
+            .group_by("product").agg(pl.col("amount").fill_null(0.0).sum().alias("revenue")).sort("product"))
+
+
+def _per_product_revenue(ds, g) -> pd.Series:
+    return pd.Series(_np(g["revenue"], np.float64), index=ds.labels("product", _np(g["product"], np.int64)),
+                     name=ds.col("amount"))
+
+
+def _orders_per_customer_plan(ds):
+    n = pl.col("order_id").drop_nulls().n_unique() if ds.has("order_id") else pl.len()
+    return (_frame(ds).filter(pl.col("customer_id").is_not_null())
+            .group_by("customer_id").agg(n.alias("n")).sort("customer_id"))
+
+
+def _orders_per_customer(ds, g) -> pd.Series:
+    return pd.Series(_np(g["n"], np.int64), index=ds.labels("customer_id", _np(g["customer_id"], np.int64)))
+
+
+def _per_customer_aggregates_plan(ds):
+    return (_frame(ds)
+            .filter(pl.col("ts").is_not_null() & pl.col("customer_id").is_not_null() & pl.col("amount").is_not_null())
+            .group_by("customer_id")
+            .agg(pl.col("ts").max().alias("last"), pl.len().alias("rows"), pl.col("amount").sum().alias("revenue"))
+            .sort("customer_id"))
+
+
+def _per_customer_aggregates(ds, g) -> pd.DataFrame:
+    return pd.DataFrame({"last": _np(g["last"], np.int64), "rows": _np(g["rows"], np.int64),
+                         "revenue": _np(g["revenue"], np.float64)},
+                        index=ds.labels("customer_id", _np(g["customer_id"], np.int64)))
+
+
+_NODES = {
+    "monthly_revenue": (_monthly_revenue_plan, _monthly_revenue),
+    "per_product_revenue": (_per_product_revenue_plan, _per_product_revenue),
+    "orders_per_customer": (_orders_per_customer_plan, _orders_per_customer),
+    "per_customer_aggregates": (_per_customer_aggregates_plan, _per_customer_aggregates),
+}
+# Mapping fields each plan reads; nodes missing one are left to the per-node path
+# (which fails the way the pandas node does) instead of failing the whole batch
+_FIELDS = {
+    "monthly_revenue": ("date", "amount"),
+    "per_product_revenue": ("product",),
+    "orders_per_customer": ("customer_id",),
+    "per_customer_aggregates": ("date", "customer_id", "amount"),
+}
+
+
+def _node(name: str) -> Callable:
+    plan, finish = _NODES[name]
+
+    def build(ds: PreparedDataset):
+        checkpoint()
+        return finish(ds, plan(ds).collect())
+    return build
+
+
+def nodes(ds: PreparedDataset, names: Iterable[str]) -> dict:
+    """Several nodes from one pl.collect_all (shared scan and filters); nodes whose
+    fields are not mapped are skipped."""
+    names = [n for n in names if n in _NODES and ds.has(*_FIELDS[n])]
+    checkpoint()
+    frames = pl.collect_all([_NODES[n][0](ds) for n in names])
+    return {n: _NODES[n][1](ds, g) for n, g in zip(names, frames)}
+
+
+def kpi_values(ds: PreparedDataset) -> dict:
+    """total_sales, num_orders, num_customers, avg_order_value as in insights.kpis."""
+    checkpoint()
+    lf = _frame(ds)
+    aggs = []
+    if ds.has("amount"):
+        aggs.append(pl.col("amount").sum().alias("total_sales"))
+    if ds.has("order_id"):
+        aggs.append(pl.col("order_id").drop_nulls().n_unique().alias("num_orders"))
+    if ds.has("customer_id"):
+        aggs.append(pl.col("customer_id").drop_nulls().n_unique().alias("num_customers"))
+    plans = [lf.select(aggs)] if aggs else []
+    if ds.has("amount", "order_id"):
+        plans.append(lf.filter(pl.col("order_id").is_not_null()).group_by("order_id")
+                     .agg(pl.col("amount").fill_null(0.0).sum().alias("s")).select(pl.col("s").mean()))
+    out = pl.collect_all(plans) if plans else []
+    row = out[0].row(0, named=True) if aggs else {}
+    aov = out[-1]["s"][0] if ds.has("amount", "order_id") else None
+    return {
+        "total_sales": float(row["total_sales"] or 0.0) if ds.has("amount") else None,
+        "num_orders": int(row["num_orders"]) if ds.has("order_id") else len(ds),
+        "num_customers": int(row["num_customers"]) if ds.has("customer_id") else None,
+        "avg_order_value": (float(aov) if aov is not None else float("nan")) if ds.has("amount", "order_id") else None,
+    }
+
+
+def cohort_counts(ds: PreparedDataset) -> pd.DataFrame:
+    """Customers per (first-purchase month, order month), month keys as in PreparedDataset.month."""
+    checkpoint()
+    g = (_frame(ds).filter(pl.col("month").is_not_null() & pl.col("customer_id").is_not_null())
+         .select("customer_id", "month").unique()
+         .with_columns(pl.col("month").min().over("customer_id").alias("cohort"))
+         .group_by("cohort", "month").agg(pl.len().alias("n"))
+         .collect())
+    return pd.DataFrame({"cohort": _np(g["cohort"], np.int64), "order_month": _np(g["month"], np.int64),
+                         "n": _np(g["n"], np.int64)})
+
+
+KERNELS: Dict[str, Callable] = {
+    **{name: _node(name) for name in _NODES},
+    "nodes": nodes,
+    "kpis": kpi_values,
+    "cohort_counts": cohort_counts,
+}
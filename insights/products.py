@@ -1,20 +1,19 @@
 import pandas as pd
 
-def _ok(df, cols):
-    return all(c and c in df for c in cols)
+from core.prepared import PreparedDataset
+from .nodes import node
 
-def top_products(df: pd.DataFrame, mapping) -> dict:
-    prod, amt = mapping.product, mapping.amount
-    if not _ok(df, [prod, amt]):
+
+def top_products(ds: PreparedDataset, mapping) -> dict:
+    if not ds.has("product", "amount"):
         return {"error": "Need product and amount"}
-    g = df.groupby(prod)[amt].sum().sort_values(ascending=False).head(15).reset_index()
+    g = node(ds, "per_product_revenue").sort_values(ascending=False).head(15).reset_index()
     g.columns = ["product", "revenue"]
     return {"table": g}
 
-def bottom_products(df: pd.DataFrame, mapping) -> dict:
-    prod, amt = mapping.product, mapping.amount
-    if not _ok(df, [prod, amt]):
+def bottom_products(ds: PreparedDataset, mapping) -> dict:
+    if not ds.has("product", "amount"):
         return {"error": "Need product and amount"}
-    g = df.groupby(prod)[amt].sum().sort_values(ascending=True).head(15).reset_index()
+    g = node(ds, "per_product_revenue").sort_values(ascending=True).head(15).reset_index()
     g.columns = ["product", "revenue"]
     return {"table": g}
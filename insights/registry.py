@@ -1,7 +1,18 @@
 # insights/registry.py
-from typing import Dict
-import pandas as pd
-from . import kpis, trend, products, customers, cohorts, rfm, forecast
+import os
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import CancelledError as FutureCancelled, TimeoutError as FutureTimeout
+from typing import Dict, Iterator, Optional
+from core import perf, runs
+from core.fingerprint import fingerprint, rows_fingerprint
+from core.prepared import prepare
+from . import engine, kpis, trend, products, customers, cohorts, rfm, forecast
+from .degrade import DEGRADED, degraded
+from .nodes import NODES, build_together, node
 
 AVAILABLE = {
     "kpis": kpis.compute_kpis,
@@ -14,11 +25,393 @@ AVAILABLE = {
     "forecast": forecast.naive_forecast,
 }
 
-def run_all(df: pd.DataFrame, mapping) -> Dict[str, dict]:
-    results = {}
-    for qid, fn in AVAILABLE.items():
+# Shared intermediates (insights.nodes) each insight reads; every node is computed
+# once per run before the insights start, so 8 insights cost 4 node passes + their own work
+DEPENDS = {
+    "kpis": (),
+    "trend": ("monthly_revenue",),
+    "top_products": ("per_product_revenue",),
+    "bottom_products": ("per_product_revenue",),
+    "repeat_rate": ("orders_per_customer",),
+    "cohorts": (),
+    "rfm": ("per_customer_aggregates",),
+    "forecast": ("monthly_revenue",),
+}
+
+# Mapping fields each insight reads; remapping any other field leaves its cached result valid
+FIELDS = {
+    "kpis": ("amount", "order_id", "customer_id"),
+    "trend": ("date", "amount"),
+    "top_products": ("product", "amount"),
+    "bottom_products": ("product", "amount"),
+    "repeat_rate": ("customer_id", "order_id"),
+    "cohorts": ("date", "customer_id"),
+    "rfm": ("date", "customer_id", "amount"),
+    "forecast": ("date", "amount"),
+}
+
+# Bump an insight's version whenever its output changes, to retire cached results
+VERSION = {qid: 1 for qid in AVAILABLE}
+
+EXECUTORS = ("serial", "thread", "process", "service")
+# LazyResults re-prefetches on every filter change; a process pool would pickle the whole
+# dataset into each worker every time, so lazy results use the service instead
+LAZY_EXECUTORS = ("serial", "thread", "service")
+
+# Dataset shipped once to each worker process (see _init_worker)
+_WORKER_ARGS = None
+
+# Full computations that overran their budget keep running here; cache key -> future
+_BACKGROUND: Optional[ThreadPoolExecutor] = None
+_PENDING: Dict[str, Future] = {}
+_BG_LOCK = threading.Lock()
+
+
+def _run_one(qid: str, ds, mapping):
+    """(result, seconds) for one insight; errors become {"error": ...} so one failure never sinks the run.
+    runs.Cancelled (a superseded run) propagates instead and is never cached."""
+    runs.checkpoint()
+    t = time.perf_counter()
+    with perf.measure(f"insight:{qid}"):
         try:
-            results[qid] = fn(df, mapping=mapping)
+            res = AVAILABLE[qid](ds, mapping=mapping)
         except Exception as e:
-            results[qid] = {"error": str(e)}
+            res = {"error": str(e)}
+    return res, time.perf_counter() - t
+
+
+def _budget(budgets: Optional[dict], qid: str) -> Optional[float]:
+    if not budgets or qid not in DEGRADED:
+        return None
+    b = budgets.get(qid, budgets.get("default"))
+    return float(b) if b else None
+
+
+def _finish(key: str, fut: Future, cache) -> None:
+    with _BG_LOCK:
+        if _PENDING.get(key) is fut:
+            del _PENDING[key]
+    if cache is not None and not fut.cancelled() and fut.exception() is None:
+        cache.put(key, fut.result()[0])
+
+
+def _run_budgeted(qid: str, ds, mapping, budget: Optional[float], degrade_opts: Optional[dict] = None,
+                  key: Optional[str] = None, cache=None, submit=None):
+    """
+    (result, seconds) within `budget` seconds. Past the budget a degraded result
+    (insights.degrade) is returned while the full computation keeps running in the
+    background; with a `key` it is cached when done and reused by later runs.
+    `submit(qid)` runs the full computation elsewhere (insights.service) instead of
+    on the background thread pool.
+    """
+    if not budget and submit is None:
+        return _run_one(qid, ds, mapping)
+    t = time.perf_counter()
+    global _BACKGROUND
+    created = False
+    with _BG_LOCK:
+        fut = _PENDING.get(key) if key is not None else None
+        if fut is not None and (fut.cancelled() or (fut.done() and fut.exception() is not None)):
+            fut = None  # left behind by a cancelled run
+        if fut is None:
+            created = True
+            if submit is not None:
+                fut = submit(qid)
+            else:
+                if _BACKGROUND is None:
+                    _BACKGROUND = ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="insight-bg")
+                fut = _BACKGROUND.submit(perf.bind(_run_one), qid, ds, mapping)
+            if runs.current() is not None:
+                runs.current().track(fut)
+            if key is not None:
+                _PENDING[key] = fut
+    if created and key is not None:
+        # once per future (outside the lock: a finished future runs it right away);
+        # later runs that wait on the same future must not cache its result again
+        fut.add_done_callback(lambda f: _finish(key, f, cache))
+    try:
+        res, _ = fut.result(timeout=budget)
+    except (runs.Cancelled, FutureCancelled):
+        # The shared computation belonged to a superseded run; ours is still current
+        runs.checkpoint()
+        return _run_budgeted(qid, ds, mapping, budget, degrade_opts, key, cache, submit)
+    except FutureTimeout:
+        with perf.measure(f"degraded:{qid}"):
+            try:
+                res = degraded(qid, ds, mapping, degrade_opts)
+            except Exception as e:
+                res = {"error": str(e)}
+    except Exception as e:
+        # the worker pool broke or the job failed outside the insight (e.g. its published
+        # dataset was removed); insight errors themselves come back as {"error": ...}
+        print(f"[registry] {qid} failed on the worker ({type(e).__name__}: {e}); computing it in-process")
+        return _run_one(qid, ds, mapping)
+    return res, time.perf_counter() - t
+
+
+def insight_key(dataset_fp: str, mapping, rows_fp: str, qid: str) -> str:
+    """Cache key: (dataset fingerprint, mapped fields read, filter predicate, insight id, version)."""
+    fields = ",".join(f"{f}={getattr(mapping, f, None)}" for f in FIELDS.get(qid, ()))
+    return f"{dataset_fp}|{fields}|{rows_fp}|{qid}|v{VERSION.get(qid, 0)}"
+
+
+def _build_node(name: str, ds):
+    """Seconds spent on one node; failures are left to the insights that need it (they report the error)."""
+    t = time.perf_counter()
+    with perf.measure(f"node:{name}"):
+        try:
+            node(ds, name)
+        except Exception:
+            pass
+    return time.perf_counter() - t
+
+
+def _build_together(names, ds) -> list:
+    """Nodes built in one shared pass when the engine plans them together (polars);
+    [] otherwise or on failure (the per-node path then reports the error)."""
+    if len(names) < 2 or engine.kernel("nodes") is None:
+        return []
+    with perf.measure("node:" + "+".join(names)):
+        try:
+            return build_together(ds, names)
+        except Exception:
+            return []
+
+
+def required_nodes(qids) -> list:
+    """Nodes needed by the given insights, in first-use order."""
+    return list(dict.fromkeys(n for q in qids for n in DEPENDS.get(q, ()) if n in NODES))
+
+
+def _init_worker(ds, mapping) -> None:
+    global _WORKER_ARGS
+    _WORKER_ARGS = (ds, mapping)
+
+
+def _run_in_worker(qid: str):
+    return _run_one(qid, *_WORKER_ARGS)
+
+
+def _submitter(service, handle, mapping, filters):
+    """submit(qid) for _run_budgeted when insights run on the worker service (None otherwise)."""
+    if service is None or handle is None:
+        return None
+    if not engine.fork_safe():
+        print(f"[registry] compute.engine {engine.current()!r} cannot run on forked service workers; using threads")
+        return None
+    return lambda qid: service.submit(handle, mapping, filters, qid)
+
+
+def _waited(qid: str, submit):
+    """The worker does the timing of an insight it runs; here only the wait is recorded."""
+    return perf.measure(f"insight:{qid}", executor="service") if submit is not None else nullcontext()
+
+
+def critical_path(insights: Dict[str, float], nodes: Dict[str, float]) -> dict:
+    """
+    Slowest dependency chain of a run from per-insight and per-node seconds: a node
+    runs before the insights reading it, so an insight's path is its slowest node
+    plus itself. `critical_path_steps` lists that chain as (step, seconds).
+    """
+    path = {q: secs + max((nodes.get(n, 0.0) for n in DEPENDS.get(q, ())), default=0.0)
+            for q, secs in insights.items()}
+    if not path:
+        return {"critical_path": None, "critical_path_seconds": 0.0, "critical_path_steps": []}
+    q = max(path, key=path.get)
+    deps = [n for n in DEPENDS.get(q, ()) if n in nodes]
+    slowest = max(deps, key=nodes.get) if deps else None
+    steps = ([(f"node:{slowest}", nodes[slowest])] if slowest else []) + [(f"insight:{q}", insights[q])]
+    return {"critical_path": q, "critical_path_seconds": path[q], "critical_path_steps": steps}
+
+
+@perf.timed("run_all")
+def run_all(data, mapping, executor: str = "thread", max_workers: Optional[int] = None,
+            timings: Optional[dict] = None, budgets: Optional[dict] = None,
+            degrade_opts: Optional[dict] = None, service=None, handle=None,
+            filters: Optional[dict] = None) -> Dict[str, dict]:
+    """
+    Run every insight on a PreparedDataset (a DataFrame is prepared first).
+    `executor` is "serial", "thread" (NumPy/pandas kernels release the GIL),
+    "process" or "service"; results keep the AVAILABLE order whatever finishes first.
+    "service" sends (handle, mapping, filters) jobs to a long-lived
+    insights.service.WorkerService: `handle` is the published unfiltered dataset and
+    `filters` the active_filters that select `data` from it. Without them it runs as "thread".
+    Shared nodes (DEPENDS) are computed first, once each, then the insights
+    (service workers build the nodes themselves, once per filtered view).
+    Pass a dict as `timings` to receive per-node, per-insight and total wall-clock seconds.
+    `budgets` maps insight id (or "default") to seconds; an insight with a degraded
+    variant that overruns returns that instead, flagged {"degraded": note}
+    (not with "process").
+    """
+    ds = prepare(data, mapping)
+    qids = list(AVAILABLE)
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor {executor!r}; expected one of {EXECUTORS}")
+    submit = _submitter(service, handle, mapping, filters) if executor == "service" else None
+    if executor == "service" and submit is None:
+        executor = "thread"
+    workers = max(1, min(len(qids), (service.workers if submit else max_workers) or os.cpu_count() or 1))
+    if workers == 1:
+        executor = "serial"
+
+    t0 = time.perf_counter()
+    # 1) shared nodes (independent of each other); process workers then receive them with the dataset
+    names = required_nodes(qids) if submit is None else []
+    t = time.perf_counter()
+    together = _build_together(names, ds)
+    node_secs = dict.fromkeys(together, time.perf_counter() - t)  # one shared plan
+    rest = [n for n in names if n not in node_secs]
+    if executor == "serial" or len(rest) <= 1:
+        node_secs.update((n, _build_node(n, ds)) for n in rest)
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(rest)), thread_name_prefix="node") as ex:
+            node_secs.update(zip(rest, ex.map(perf.bind(_build_node), rest, [ds] * len(rest))))
+    # 2) insights
+    def run(q):
+        with _waited(q, submit):
+            return _run_budgeted(q, ds, mapping, _budget(budgets, q), degrade_opts, submit=submit)
+
+    if executor == "serial":
+        done = [run(q) for q in qids]
+    elif executor in ("thread", "service"):
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="insight") as ex:
+            done = list(ex.map(perf.bind(run), qids))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(ds, mapping)) as ex:
+            done = list(ex.map(_run_in_worker, qids))
+    wall = time.perf_counter() - t0
+
+    results = {q: res for q, (res, _) in zip(qids, done)}
+    if timings is not None:
+        per = {q: secs for q, (_, secs) in zip(qids, done)}
+        timings.update({
+            "executor": executor,
+            "workers": workers,
+            "wall": wall,
+            "nodes": node_secs,
+            "insights": per,
+            **critical_path(per, node_secs),
+        })
     return results
+
+
+class LazyResults(Mapping):
+    """
+    run_all's result dict, computed on demand: an insight runs the first time
+    it is looked up (results["rfm"], results.get("cohorts")) and is memoized on
+    the dataset view, so only the tabs / answers actually shown pay for theirs.
+    With a `cache`, results are also shared across views and reruns
+    under insight_key(): going back to earlier filters, or filters selecting the
+    same rows, is a hit, and remapping a field only recomputes insights reading it.
+    With executor="service" (plus `service`, `handle`, `filters` as for run_all)
+    every insight runs on the worker service and this process only waits;
+    "process" is not supported here (see LAZY_EXECUTORS).
+    """
+
+    def __init__(self, data, mapping, executor: str = "thread", max_workers: Optional[int] = None,
+                 cache=None, dataset_fp: Optional[str] = None, budgets: Optional[dict] = None,
+                 degrade_opts: Optional[dict] = None, service=None, handle=None,
+                 filters: Optional[dict] = None):
+        if executor not in LAZY_EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r} for lazy results; expected one of {LAZY_EXECUTORS} "
+                             "(use 'service' for worker processes)")
+        self.ds = prepare(data, mapping)
+        self.mapping = mapping
+        self.budgets = budgets
+        self.degrade_opts = degrade_opts
+        self._submit = _submitter(service, handle, mapping, filters) if executor == "service" else None
+        self.executor = "thread" if executor == "service" and self._submit is None else executor
+        self.max_workers = service.workers if self._submit is not None else max_workers
+        # Optional shared store (core.cache.insight_cache); the source frame is fingerprinted
+        # unless the caller already has a content key for it (e.g. the upload's SHA-256)
+        self.cache = cache
+        self.dataset_fp = dataset_fp or (fingerprint(self.ds.source) if cache is not None else None)
+        self._rows_fp = rows_fingerprint(self.ds.rows, len(self.ds.source)) if cache is not None else None
+        self._seconds: Dict[str, float] = {}
+        self._node_seconds: Dict[str, float] = {}
+        self._cached: list = []
+        # degraded stand-ins handed out so far; never memoized on the view, which may be the
+        # shared unfiltered dataset, so lookups keep checking the cache for the full result
+        self._degraded: Dict[str, dict] = {}
+
+    def prefetch(self, qids) -> None:
+        """Compute the given (not yet computed) insights concurrently on the configured executor."""
+        todo = [q for q in dict.fromkeys(qids)
+                if q in AVAILABLE and ("insight", q) not in self.ds._memo and q not in self._degraded]
+        if self.cache is not None:
+            for q in [q for q in todo if self.key(q) in self.cache]:
+                self[q]
+            todo = [q for q in todo if ("insight", q) not in self.ds._memo]
+        if self._submit is None:
+            t = time.perf_counter()
+            built = _build_together(required_nodes(todo), self.ds)
+            self._node_seconds.update(dict.fromkeys(built, time.perf_counter() - t))  # one shared plan
+        workers = max(1, min(len(todo), self.max_workers or os.cpu_count() or 1))
+        if workers == 1 or self.executor == "serial":
+            for q in todo:
+                self[q]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="insight") as ex:
+                list(ex.map(perf.bind(self.__getitem__), todo))
+
+    def __getitem__(self, qid: str) -> dict:
+        if qid not in AVAILABLE:
+            raise KeyError(qid)
+        stand_in = self._degraded.get(qid)
+        if stand_in is not None and not (self.cache is not None and self.key(qid) in self.cache):
+            return stand_in  # full result not ready yet
+        res = self.ds.memo(("insight", qid), lambda: self._compute(qid))
+        if isinstance(res, dict) and res.get("degraded"):
+            self.ds._memo.pop(("insight", qid), None)
+            self._degraded[qid] = res
+        else:
+            self._degraded.pop(qid, None)
+        return res
+
+    def key(self, qid: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return insight_key(self.dataset_fp, self.mapping, self._rows_fp, qid)
+
+    def _compute(self, qid: str) -> dict:
+        key = self.key(qid)
+        if key is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                self._cached.append(qid)
+                return hit
+        budget = _budget(self.budgets, qid)
+        if self._submit is None and not budget:
+            # nodes first, as in run_all, so the insight's own seconds and its nodes' add up
+            # to its path (with a budget or on the service they stay inside the insight)
+            for n in DEPENDS.get(qid, ()):
+                if n in NODES and ("node", n, engine.current()) not in self.ds._memo:
+                    secs = _build_node(n, self.ds)
+                    self._node_seconds[n] = max(secs, self._node_seconds.get(n, 0.0))
+        with _waited(qid, self._submit):
+            res, secs = _run_budgeted(qid, self.ds, self.mapping, budget,
+                                      self.degrade_opts, key=key, cache=self.cache, submit=self._submit)
+        self._seconds[qid] = secs
+        # degraded stand-ins are not cached (see __getitem__); the full result is cached when ready
+        if key is not None and not (isinstance(res, dict) and res.get("degraded")):
+            self.cache.put(key, res)
+        return res
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(AVAILABLE)
+
+    def __len__(self) -> int:
+        return len(AVAILABLE)
+
+    def computed(self) -> list:
+        """Insights evaluated so far, in evaluation order (cache hits excluded)."""
+        return list(self._seconds)
+
+    def cached(self) -> list:
+        """Insights served from the shared cache."""
+        return list(self._cached)
+
+    def timings(self) -> dict:
+        """Seconds of the nodes and insights computed so far and their critical path (as run_all's timings)."""
+        return {"nodes": dict(self._node_seconds), "insights": dict(self._seconds),
+                **critical_path(self._seconds, self._node_seconds)}
@@ -1,18 +1,19 @@
 import pandas as pd
 import numpy as np
 
-def rfm_segments(df: pd.DataFrame, mapping) -> dict:
-    date, cid, amt = mapping.date, mapping.customer_id, mapping.amount
-    if not date or not cid or not amt or date not in df or cid not in df or amt not in df:
+from core.prepared import PreparedDataset, NS_PER_DAY
+from core.runs import checkpoint
+from .nodes import node
+
+
+def rfm_segments(ds: PreparedDataset, mapping) -> dict:
+    if not ds.has("date", "customer_id", "amount"):
         return {"error": "Need date, customer_id, amount"}
-    tbl = df[[date, cid, amt]].dropna()
-    tbl[date] = pd.to_datetime(tbl[date], errors="coerce")
-    tbl = tbl.dropna(subset=[date])
-    snapshot = tbl[date].max() + pd.Timedelta(days=1)
-    r = tbl.groupby(cid)[date].max().apply(lambda d: (snapshot - d).days)
-    f = tbl.groupby(cid).size()
-    m = tbl.groupby(cid)[amt].sum()
-    rfm = pd.DataFrame({"CustomerID": r.index, "Recency": r.values, "Frequency": f.values, "Monetary": m.values})
+    agg = node(ds, "per_customer_aggregates")
+    checkpoint()
+    snapshot = agg["last"].max() + NS_PER_DAY
+    r = (snapshot - agg["last"]) // NS_PER_DAY
+    rfm = pd.DataFrame({"CustomerID": agg.index, "Recency": r.values, "Frequency": agg["rows"].values, "Monetary": agg["revenue"].values})
     # tertiles
     r_score = pd.qcut(rfm['Recency'].rank(method='first'), 3, labels=[3,2,1])
     f_score = pd.qcut(rfm['Frequency'].rank(method='first'), 3, labels=[1,2,3])
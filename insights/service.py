@@ -0,0 +1,309 @@
+"""
+insights/service.py
+Long-lived local worker processes for insights (compute.executor: service).
+A prepared dataset is published once as an Arrow IPC file that every worker
+memory-maps, so a job only carries the dataset handle, the mapping, the active
+filters and the insight id; no row-sized data is pickled per job.
+Workers are forked from the app process, which has already imported the numeric
+stack and the insights package, and each runs every insight once on a tiny frame
+before its first job (compute.warm starts them with the app), so the first real
+insight does not pay for imports or first-call setup.
+"""
+
+from __future__ import annotations
+import hashlib
+import importlib
+import importlib.util
+import multiprocessing
+import os
+import pickle
+import shutil
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core.prepared import PreparedDataset
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+except Exception:
+    pa = None
+
+# Published datasets kept on disk (oldest dropped first); workers keep as many mapped
+MAX_PUBLISHED = 8
+# Filtered views (with their node memo) kept per worker
+MAX_VIEWS = 16
+
+_ARRAYS = ("ts", "amount", "month", "week", "day")
+
+# Published dirs with jobs queued or running (path -> jobs); eviction skips them, since a
+# worker that has not mapped a dir yet would find it gone
+_IN_USE: Counter = Counter()
+_IN_USE_LOCK = threading.Lock()
+
+# Imported by every worker before its first job (most are inherited from the app already)
+PRELOAD = ("numpy", "pandas", "pyarrow", "sklearn", "core.prepared", "core.filters", "insights.registry")
+
+
+@dataclass(frozen=True)
+class DatasetHandle:
+    """Directory holding `data.arrow` (row arrays) and `labels.pkl` (distinct values per coded field)."""
+    path: str
+    n_rows: int
+
+
+def _handle_dir(directory: str, key: str) -> Path:
+    return Path(directory).expanduser() / "ipc" / hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+
+def publish(ds: PreparedDataset, key: str, directory: str = ".omni_cache") -> Optional[DatasetHandle]:
+    """
+    Write the arrays of `ds` once per `key` (e.g. dataset key + mapping) and return
+    their handle; an existing copy is reused. None when pyarrow is unavailable.
+    """
+    if pa is None:
+        return None
+    path = _handle_dir(directory, key)
+    if (path / "data.arrow").exists():
+        os.utime(path)  # mark as recently used
+        return DatasetHandle(str(path), len(ds))
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp.mkdir(parents=True)
+        cols = {}
+        for name in _ARRAYS:
+            a = getattr(ds, name)
+            if a is not None:
+                # datetime64 as raw int64 so NaT survives (Arrow would turn it into a null)
+                cols[name] = pa.array(a.view(np.int64) if name == "ts" else a)
+        for f, c in ds.codes.items():
+            cols[f"code:{f}"] = pa.array(c)
+        batch = pa.RecordBatch.from_pydict(cols) if cols else pa.RecordBatch.from_pydict({"_": pa.nulls(len(ds))})
+        with pa.OSFile(str(tmp / "data.arrow"), "wb") as sink, pa.ipc.new_file(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        with open(tmp / "labels.pkl", "wb") as fh:
+            pickle.dump(dict(ds.uniques), fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        # another session published the same key first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not (path / "data.arrow").exists():
+            return None
+    except Exception as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        print(f"[service] Could not publish dataset: {e}")
+        return None
+    _evict(path.parent, keep=path)
+    return DatasetHandle(str(path), len(ds))
+
+
+def _evict(root: Path, keep: Path) -> None:
+    try:
+        dirs = sorted((p for p in root.iterdir() if p.is_dir() and not p.name.endswith(".tmp")),
+                      key=lambda p: p.stat().st_mtime)
+    except FileNotFoundError:
+        return
+    with _IN_USE_LOCK:
+        busy = {path for path, jobs in _IN_USE.items() if jobs}
+    for p in dirs[:max(0, len(dirs) - MAX_PUBLISHED)]:
+        if p != keep and str(p) not in busy:
+            shutil.rmtree(p, ignore_errors=True)  # workers that mapped it keep their pages
+
+
+def _release(path: str) -> None:
+    with _IN_USE_LOCK:
+        _IN_USE[path] -= 1
+        if _IN_USE[path] <= 0:
+            del _IN_USE[path]
+
+
+# ---------------- worker side ----------------
+_OPEN: "OrderedDict[str, PreparedDataset]" = OrderedDict()
+_VIEWS: "OrderedDict[tuple, PreparedDataset]" = OrderedDict()
+
+
+def _column(table, name: str) -> np.ndarray:
+    col = table.column(name)
+    arr = col.chunk(0) if col.num_chunks == 1 else col.combine_chunks()
+    return arr.to_numpy(zero_copy_only=False)  # zero-copy view into the mapping (no nulls)
+
+
+def open_dataset(handle: DatasetHandle, mapping) -> PreparedDataset:
+    """Memory-map a published dataset (once per worker)."""
+    ds = _OPEN.get(handle.path)
+    if ds is not None:
+        _OPEN.move_to_end(handle.path)
+        return ds
+    table = pa.ipc.open_file(pa.memory_map(os.path.join(handle.path, "data.arrow"))).read_all()
+    with open(os.path.join(handle.path, "labels.pkl"), "rb") as fh:
+        uniques = pickle.load(fh)
+    names = set(table.column_names)
+    arrays = {n: _column(table, n) for n in _ARRAYS if n in names}
+    if "ts" in arrays:
+        arrays["ts"] = arrays["ts"].view("datetime64[ns]")
+    ds = PreparedDataset(
+        mapping=mapping,
+        # insights only read the arrays; an empty frame of the right length stands in for the upload
+        source=pd.DataFrame(index=pd.RangeIndex(handle.n_rows)),
+        codes={f: _column(table, f"code:{f}") for f in uniques},
+        uniques=uniques,
+        **arrays,
+    )
+    _OPEN[handle.path] = ds
+    while len(_OPEN) > MAX_PUBLISHED:
+        _OPEN.popitem(last=False)
+    return ds
+
+
+def _view(handle: DatasetHandle, mapping, filters: Optional[dict]) -> PreparedDataset:
+    """Filtered view of a published dataset; reused by later jobs so nodes are shared."""
+    from core.filters import apply_filters
+
+    key = (handle.path, repr(sorted((filters or {}).items())))
+    ds = _VIEWS.get(key)
+    if ds is None:
+        ds = _VIEWS[key] = apply_filters(open_dataset(handle, mapping), filters or {})
+        while len(_VIEWS) > MAX_VIEWS:
+            _VIEWS.popitem(last=False)
+    _VIEWS.move_to_end(key)
+    return ds
+
+
+def _job(handle: DatasetHandle, mapping, filters: Optional[dict], qid: str):
+    from insights.registry import _run_one
+
+    return _run_one(qid, _view(handle, mapping, filters), mapping)
+
+
+def _warm_worker() -> None:
+    """Pool initializer: import PRELOAD (no-op for modules inherited from the app) and run
+    every insight on a few synthetic rows, so lazy imports and first-call setup inside
+    pandas / NumPy happen before the first real job."""
+    for name in PRELOAD:
+        if importlib.util.find_spec(name) is not None:
+            importlib.import_module(name)
+    try:
+        from core.semantics import ColumnMapping
+        from insights.registry import AVAILABLE, _run_one
+
+        n = 64
+        df = pd.DataFrame({
+            "d": pd.date_range("2024-01-01", periods=n, freq="5D"),
+            "a": np.linspace(1.0, 50.0, n),
+            "o": np.arange(n) // 2,
+            "c": np.arange(n) % 7,
+            "p": np.arange(n) % 5,
+            "ch": np.arange(n) % 3,
+        })
+        mapping = ColumnMapping(date="d", amount="a", order_id="o", customer_id="c", product="p", channel="ch")
+        ds = PreparedDataset.build(df, mapping)
+        for qid in AVAILABLE:
+            _run_one(qid, ds, mapping)
+    except Exception as e:
+        print(f"[service] Worker warm-up skipped: {e}")
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def _context():
+    """fork where available, so workers inherit the app's imports; None elsewhere (macOS
+    default builds, Windows). spawn / forkserver children would re-run the Streamlit
+    script, which is registered as __main__, so the service is never started on them."""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def available() -> bool:
+    """True where worker processes can be forked; callers run insights on threads otherwise."""
+    return _context() is not None
+
+
+# ---------------- service ----------------
+class WorkerService:
+    """Pool of worker processes that stays up between runs and sessions."""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._started: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                ctx = _context()
+                if ctx is None:
+                    raise RuntimeError("the worker service needs fork(); run insights on threads instead")
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx,
+                                                 initializer=_warm_worker)
+            return self._pool
+
+    def _submit(self, fn, *args) -> Future:
+        pool = self._executor()
+        try:
+            return pool.submit(fn, *args)
+        except BrokenExecutor:
+            # a worker died (e.g. out of memory); start a fresh pool once
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            return self._executor().submit(fn, *args)
+
+    def start(self) -> list:
+        """Spawn and warm every worker now, without waiting (e.g. at server start);
+        futures of their pids. Later calls on the same pool do nothing."""
+        pool = self._executor()
+        with self._lock:
+            if self._started is pool:
+                return []
+            self._started = pool
+        return [self._submit(_ready) for _ in range(self.workers)]
+
+    def submit(self, handle: DatasetHandle, mapping, filters: Optional[dict], qid: str) -> Future:
+        """Future of (result, seconds) for one insight on the filtered dataset. The
+        handle's directory is kept on disk until the job is done."""
+        with _IN_USE_LOCK:
+            _IN_USE[handle.path] += 1
+        try:
+            fut = self._submit(_job, handle, mapping, filters, qid)
+        except BaseException:
+            _release(handle.path)
+            raise
+        fut.add_done_callback(lambda f: _release(handle.path))
+        return fut
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_SERVICE: Optional[WorkerService] = None
+
+
+def worker_service(cfg: dict) -> Optional[WorkerService]:
+    """Process-wide worker service sized by compute.workers (warmed up front with compute.warm);
+    None where workers cannot be forked (see available)."""
+    global _SERVICE
+    if not available():
+        return None
+    workers = max(1, cfg.get("compute", {}).get("workers") or os.cpu_count() or 1)
+    if _SERVICE is None or _SERVICE.workers != workers:
+        if _SERVICE is not None:
+            _SERVICE.shutdown()
+        _SERVICE = WorkerService(workers)
+    if cfg.get("compute", {}).get("warm", True):
+        _SERVICE.start()
+    return _SERVICE
@@ -0,0 +1,125 @@
+"""
+insights/sqlengine.py
+DuckDB engine for the full-data passes behind the insights (compute.engine: duckdb).
+With engine "duckdb" the shared nodes, the KPI aggregates and the cohort counts run as
+SQL over the PreparedDataset's Arrow view on core.sqlctx's per-dataset connections
+(multithreaded, spilling to disk past compute.duckdb_memory_limit); the small
+per-group finishing steps (top-N, RFM scores, moving averages, the retention pivot)
+stay shared with the pandas engine.
+"""
+
+from __future__ import annotations
+import math
+import os
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from core.prepared import PreparedDataset
+from core.runs import checkpoint
+from core.sqlctx import connections, duckdb  # noqa: F401  (duckdb: availability, see insights.engine)
+
+
+def configure(cfg: dict) -> None:
+    """Apply compute.duckdb_threads / duckdb_memory_limit (spill files go under cache.dir)."""
+    c = cfg.get("compute", {}) or {}
+    connections().configure(
+        threads=c.get("duckdb_threads"),
+        memory_limit=c.get("duckdb_memory_limit"),
+        temp_directory=os.path.join(cfg.get("cache", {}).get("dir", ".omni_cache"), "duckdb_tmp"),
+    )
+
+
+def _query(ds: PreparedDataset, sql: str) -> pd.DataFrame:
+    """Run `sql` against table `t` (this view's rows, see core.sqlctx.DuckConnections)."""
+    checkpoint()
+    with connections().cursor(ds) as cur:
+        return cur.execute(sql).df()
+
+
+# ---------------- kernels (same shapes as insights.nodes / kpis / cohorts) ----------------
+def monthly_revenue(ds: PreparedDataset) -> pd.DataFrame:
+    from .nodes import monthly_frame
+
+    g = _query(ds, "SELECT month, fsum(amount) AS revenue FROM t "
+                   "WHERE month IS NOT NULL AND amount IS NOT NULL GROUP BY month")
+    if g.empty:
+        return monthly_frame(0, np.array([], dtype=float))
+    m = g["month"].to_numpy(np.int64)
+    lo = int(m.min())
+    sums = np.zeros(int(m.max()) - lo + 1)
+    sums[m - lo] = g["revenue"].to_numpy(np.float64)
+    return monthly_frame(lo, sums)
+
+
+def _per_code(ds: PreparedDataset, f: str, agg: str, where: str = "") -> pd.DataFrame:
+    return _query(ds, f"SELECT {f} AS code, {agg} FROM t WHERE {f} IS NOT NULL {where} GROUP BY {f} ORDER BY {f}")
+
+
+def per_product_revenue(ds: PreparedDataset) -> pd.Series:
+    g = _per_code(ds, "product", "fsum(COALESCE(amount, 0)) AS revenue")
+    return pd.Series(g["revenue"].to_numpy(np.float64), index=ds.labels("product", g["code"]), name=ds.col("amount"))
+
+
+def orders_per_customer(ds: PreparedDataset) -> pd.Series:
+    agg = "COUNT(DISTINCT order_id) AS n" if ds.has("order_id") else "COUNT(*) AS n"
+    g = _per_code(ds, "customer_id", agg)
+    return pd.Series(g["n"].to_numpy(np.int64), index=ds.labels("customer_id", g["code"]))
+
+
+def per_customer_aggregates(ds: PreparedDataset) -> pd.DataFrame:
+    g = _per_code(ds, "customer_id", "MAX(ts) AS last, COUNT(*) AS rows, fsum(amount) AS revenue",
+                  "AND ts IS NOT NULL AND amount IS NOT NULL")
+    return pd.DataFrame({"last": g["last"].to_numpy(np.int64), "rows": g["rows"].to_numpy(np.int64),
+                         "revenue": g["revenue"].to_numpy(np.float64)},
+                        index=ds.labels("customer_id", g["code"]))
+
+
+def kpi_values(ds: PreparedDataset) -> dict:
+    """total_sales, num_orders, num_customers, avg_order_value as in insights.kpis."""
+    parts = [
+        "fsum(amount) AS total_sales" if ds.has("amount") else "NULL AS total_sales",
+        "COUNT(DISTINCT order_id) AS num_orders" if ds.has("order_id") else "NULL AS num_orders",
+        "COUNT(DISTINCT customer_id) AS num_customers" if ds.has("customer_id") else "NULL AS num_customers",
+    ]
+    if ds.has("amount", "order_id"):
+        parts.append("(SELECT AVG(s) FROM (SELECT fsum(COALESCE(amount, 0)) AS s FROM t "
+                     "WHERE order_id IS NOT NULL GROUP BY order_id)) AS avg_order_value")
+    else:
+        parts.append("NULL AS avg_order_value")
+    row = _query(ds, f"SELECT {', '.join(parts)} FROM t").iloc[0]
+
+    def num(v):
+        return None if v is None or v is pd.NA or (isinstance(v, float) and math.isnan(v)) else v
+
+    total, orders, customers, aov = (num(row[k]) for k in ("total_sales", "num_orders", "num_customers", "avg_order_value"))
+    return {
+        "total_sales": (float(total) if total is not None else 0.0) if ds.has("amount") else None,
+        "num_orders": int(orders) if ds.has("order_id") else len(ds),
+        "num_customers": int(customers) if ds.has("customer_id") else None,
+        "avg_order_value": (float(aov) if aov is not None else float("nan")) if ds.has("amount", "order_id") else None,
+    }
+
+
+def cohort_counts(ds: PreparedDataset) -> pd.DataFrame:
+    """Customers per (first-purchase month, order month), month keys as in PreparedDataset.month."""
+    g = _query(ds, """
+        WITH p AS (SELECT DISTINCT customer_id, month FROM t
+                   WHERE month IS NOT NULL AND customer_id IS NOT NULL)
+        SELECT cohort, order_month, COUNT(*) AS n
+        FROM (SELECT MIN(month) OVER (PARTITION BY customer_id) AS cohort, month AS order_month FROM p)
+        GROUP BY cohort, order_month
+    """)
+    return pd.DataFrame({"cohort": g["cohort"].to_numpy(np.int64), "order_month": g["order_month"].to_numpy(np.int64),
+                         "n": g["n"].to_numpy(np.int64)})
+
+
+KERNELS: Dict[str, Callable] = {
+    "monthly_revenue": monthly_revenue,
+    "per_product_revenue": per_product_revenue,
+    "orders_per_customer": orders_per_customer,
+    "per_customer_aggregates": per_customer_aggregates,
+    "kpis": kpi_values,
+    "cohort_counts": cohort_counts,
+}
@@ -1,12 +1,8 @@
-import pandas as pd
+from core.prepared import PreparedDataset
+from .nodes import node
 
-def monthly_revenue_trend(df: pd.DataFrame, mapping) -> dict:
-    date, amt = mapping.date, mapping.amount
-    if not date or not amt or date not in df or amt not in df:
+
+def monthly_revenue_trend(ds: PreparedDataset, mapping) -> dict:
+    if not ds.has("date", "amount"):
         return {"error": "Need date and amount"}
-    tmp = df[[date, amt]].dropna()
-    tmp[date] = pd.to_datetime(tmp[date], errors="coerce")
-    tmp = tmp.dropna(subset=[date])
-    g = tmp.groupby(pd.Grouper(key=date, freq="M"))[amt].sum().reset_index()
-    g.columns = ["month", "revenue"]
-    return {"table": g}
+    return {"table": node(ds, "monthly_revenue").copy()}
@@ -1,3 +1,5 @@
+from collections.abc import Mapping
+
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
@@ -21,6 +23,12 @@ def _nonempty(df):
 def _explain(text):
     st.caption(str(text))
 
+def _degraded(res):
+    """Note shown when an insight overran its time budget and returned an approximation."""
+    if isinstance(res, dict) and res.get("degraded"):
+        st.info(f"⏳ Approximate result ({res['degraded']}) — the full computation is still running "
+                "and will appear on your next interaction.")
+
 def _fmt(val, numfmt="{:,}", fallback="—"):
     if val is None:
         return fallback
@@ -33,7 +41,7 @@ def render_overview_tab(df, results, mapping, flt):
     st.subheader("Overview")
     _explain("Quick summary of sales and customers. All visuals respect the filters at the top.")
 
-    k_container = results.get("kpis", {}) if isinstance(results, dict) else {}
+    k_container = results.get("kpis", {}) if isinstance(results, Mapping) else {}
     k = k_container.get("kpis", {}) if isinstance(k_container, dict) else {}
 
     cols = st.columns(4)
@@ -42,7 +50,7 @@ def render_overview_tab(df, results, mapping, flt):
     cols[2].markdown(f"<div class='kpi'><h3>Customers</h3><div class='v'>{_fmt(k.get('num_customers'))}</div></div>", unsafe_allow_html=True)
     cols[3].markdown(f"<div class='kpi'><h3>Avg Order Value</h3><div class='v'>{_fmt(k.get('avg_order_value'), numfmt='{:.2f}')}</div></div>", unsafe_allow_html=True)
 
-    tr_container = results.get("trend", {}) if isinstance(results, dict) else {}
+    tr_container = results.get("trend", {}) if isinstance(results, Mapping) else {}
     tr = _safe_df(tr_container.get("table") if isinstance(tr_container, dict) else None)
     if _nonempty(tr):
         xcol = "month" if "month" in tr.columns else tr.columns[0]
@@ -78,6 +86,7 @@ def render_customers_tab(df, results, mapping, flt):
     st.subheader("Customers")
     _explain("Repeat customers drive growth.")
     rr = results.get("repeat_rate", {}) if isinstance(results.get("repeat_rate", {}), dict) else {}
+    _degraded(rr)
     if isinstance(rr, dict) and ("repeat_rate" in rr) and (rr["repeat_rate"] is not None):
         st.metric("Repeat Customer Share", f"{float(rr['repeat_rate']) * 100:.1f}%")
         _explain("The percentage of customers who placed more than one order.")
@@ -88,6 +97,7 @@ def render_customers_tab(df, results, mapping, flt):
 def render_cohorts_tab(df, results, mapping, flt):
     st.subheader("Customer Cohorts")
     _explain("Groups customers by their first purchase month and tracks how many return over time.")
+    _degraded(results.get("cohorts"))
     ret = _safe_df(results.get("cohorts", {}).get("retention") if isinstance(results.get("cohorts", {}), dict) else None)
     if _nonempty(ret):
         st.dataframe(ret, use_container_width=True, hide_index=True)
@@ -98,6 +108,7 @@ def render_cohorts_tab(df, results, mapping, flt):
 def render_rfm_tab(df, results, mapping, flt):
     st.subheader("Customer Segments (RFM)")
     _explain("RFM = Recency, Frequency, Monetary. Higher scores indicate more valuable customers.")
+    _degraded(results.get("rfm"))
     tbl = _safe_df(results.get("rfm", {}).get("table") if isinstance(results.get("rfm", {}), dict) else None)
     if _nonempty(tbl):
         st.dataframe(tbl.head(200), use_container_width=True, hide_index=True)
@@ -126,6 +137,7 @@ def render_forecast_tab(df, results, mapping, flt):
 def render_ai_tab(df, results, mapping, flt):
     from core.context import build_context_pack
     from core.sqlctx import reasons_pack
+    from core.fingerprint import dataset_fingerprint
     from core.smart_questions import SmartQuestionSystem
     from datetime import datetime
 
@@ -182,8 +194,8 @@ def render_ai_tab(df, results, mapping, flt):
             "sql_md": sql_md
         }
 
-    # Create a stable signature for caching
-    context_signature = f"{df.shape}-{hash(str(flt))}-{hash(str(mapping))}"
+    # Content fingerprint of the filtered rows + mapping (stable across processes, unlike hash())
+    context_signature = f"{dataset_fingerprint(df)}-{sorted(mapping.to_dict().items())}"
     
     # Build context data once (this will be cached)
     context_data = _build_context_once(context_signature)